@@ -0,0 +1,87 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare the memory, load time and lookup time of a dict and a frozen table.
+
+    python -m benchmarks.frozen_table --entries 100000 500000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from benchmarks.hostsfile_parser import generate, generate_blocklist
+from hostsresolver import frozen_table, hostsfile_source
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+def measure_load(function):
+    """Return what ``function`` built, the seconds and bytes it took."""
+    start = _timer()
+    result = function()
+    elapsed = _timer() - start
+    # Timed without tracing, which slows allocations down.
+    del result
+    tracemalloc.start()
+    result = function()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, elapsed, size
+
+
+def lookup_time(mapping, names, number):
+    get = mapping.get
+    return min(timeit.repeat(lambda: [get(name) for name in names], number=number, repeat=3)) \
+        / number / len(names) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, nargs='+', default=[100000, 500000])
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        print('%10s %8s %-8s %10s %10s %12s' % ('shape', 'entries', 'backend', 'load', 'memory', 'lookup'))
+        for entries in args.entries:
+            for shape, content in (('hosts', generate(entries)), ('blocklist', generate_blocklist(entries))):
+                lines = content.splitlines()
+                path = os.path.join(directory, 'hosts.table')
+
+                hosts, dict_time, dict_size = measure_load(lambda: dict(hostsfile_source.iter_hosts(lines)))
+                table, build_time, build_size = measure_load(
+                    lambda: frozen_table.build(hostsfile_source.iter_hosts(lines)))
+                table.save(path)
+                loaded, map_time, map_size = measure_load(lambda: frozen_table.load(path))
+
+                names = random.Random(0).sample(sorted(hosts), min(args.lookups, len(hosts)))
+                for backend, mapping, elapsed, size in (('dict', hosts, dict_time, dict_size),
+                                                        ('built', table, build_time, build_size),
+                                                        ('mapped', loaded, map_time, map_size)):
+                    print('%10s %8d %-8s %9.1fms %9.1fMB %10.0fns' % (
+                        shape, entries, backend, elapsed * 1000, size / 1e6, lookup_time(mapping, names, 10)))
+                print('%10s %8d %-8s %10s %9.1fMB' % (shape, entries, 'file', '', os.path.getsize(path) / 1e6))
+                loaded.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
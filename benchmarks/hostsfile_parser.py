@@ -0,0 +1,99 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare the hosts file parser with the line splitting one it replaced.
+
+    python -m benchmarks.hostsfile_parser --entries 50000
+"""
+
+import argparse
+import random
+import timeit
+
+from hostsresolver import hostsfile_source
+
+
+def legacy_parse_content(content):
+    hosts = {}
+    for line in content.split('\n'):
+        items = line.split('#')[0].strip().split()
+        if len(items) < 2:
+            continue
+        address = items[0]
+        names = items[1:]
+        split_ipv4 = address.split('.')
+        if len(split_ipv4) != 4:
+            continue
+        if split_ipv4[0] == '127':
+            continue
+        for name in names:
+            hosts[name] = address
+    return hosts
+
+
+def generate_blocklist(entries):
+    """Block list content, every name sent to the same address."""
+    lines = ['# Block list', '127.0.0.1\tlocalhost', '']
+    lines.extend('0.0.0.0 ads%d.example.com' % index for index in range(entries))
+    return '\n'.join(lines) + '\n'
+
+
+def generate(entries, ipv6_ratio=0.0, seed=0):
+    """Hosts file content with comments, aliases and a share of IPv6 entries.
+
+    The legacy parser drops IPv6 entries, a non zero ratio gives it less
+    work than the current parser.
+    """
+    generator = random.Random(seed)
+    lines = ['127.0.0.1\tlocalhost', '::1\tip6-localhost ip6-loopback', '']
+    for index in range(entries):
+        if index % 100 == 0:
+            lines.append('# block %d' % (index // 100))
+        if generator.random() < ipv6_ratio:
+            address = '2001:db8::%x:%x' % (generator.randint(0, 0xffff), generator.randint(0, 0xffff))
+        else:
+            address = '10.%d.%d.%d' % (generator.randint(0, 255), generator.randint(0, 255),
+                                       generator.randint(1, 254))
+        names = ['host%d.example.org' % index]
+        if index % 3 == 0:
+            names.append('alias%d.example.org' % index)
+        lines.append('%s\t%s%s' % (address, ' '.join(names), '  # generated' if index % 7 == 0 else ''))
+    return '\n'.join(lines) + '\n'
+
+
+def measure(function, content, repeat):
+    return min(timeit.repeat(lambda: function(content), number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--ipv6-ratio', type=float, default=0.0)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print('%10s %8s %10s %12s %12s %9s %10s' % (
+        'shape', 'entries', 'bytes', 'legacy', 'current', 'speedup', 'names'))
+    for entries in args.entries:
+        for shape, content in (('hosts', generate(entries, args.ipv6_ratio)),
+                               ('blocklist', generate_blocklist(entries))):
+            legacy = measure(legacy_parse_content, content, args.repeat)
+            current = measure(hostsfile_source.parse_content, content, args.repeat)
+            print('%10s %8d %10d %11.2fms %11.2fms %8.2fx %10d' % (
+                shape, entries, len(content), legacy * 1000, current * 1000, legacy / current,
+                len(hostsfile_source.parse_content(content))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Time cached lookups before, while and after instrumenting the cache.
+
+    python -m benchmarks.instrumentation --number 200000
+"""
+
+import argparse
+import timeit
+
+from hostsresolver import cache, instrumentation
+
+
+def measure(number, repeat):
+    timer = timeit.Timer(lambda: cache.gethostbyname('first.machine.example.org'))
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    cache.clear()
+    cache.update({'first.machine.example.org': '10.0.0.1'})
+    original = cache._override
+    try:
+        before = measure(args.number, args.repeat)
+        instrumentation.enable()
+        enabled = measure(args.number, args.repeat)
+        instrumentation.disable()
+        after = measure(args.number, args.repeat)
+    finally:
+        instrumentation.disable()
+        cache.clear()
+
+    print('%-24s %10s' % ('instrumentation', 'ns/lookup'))
+    print('%-24s %10.0f' % ('never enabled', before))
+    print('%-24s %10.0f' % ('enabled', enabled))
+    print('%-24s %10.0f' % ('disabled again', after))
+    # Disabled, the lookups run the very same functions as before enabling.
+    print('original functions restored: %s' % (cache._override is original))
+
+
+if __name__ == '__main__':
+    main()
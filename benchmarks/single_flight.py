@@ -0,0 +1,95 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Count upstream lookups when many threads miss the same name at once.
+
+    python -m benchmarks.single_flight --threads 1 10 50 100 --latency 0.05
+"""
+
+import argparse
+import threading
+import time
+
+from hostsresolver import cache
+
+
+class FakeResolver(object):
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, host):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return '10.0.0.1'
+
+
+def naive_gethostbyname(resolver, hosts_cache):
+    # The lookup as it was before coalescing: every thread missing runs its
+    # own upstream lookup.
+    def gethostbyname(host):
+        try:
+            return hosts_cache[host]
+        except KeyError:
+            hosts_cache[host] = resolver(host)
+        return hosts_cache[host]
+    return gethostbyname
+
+
+def run(thread_count, gethostbyname):
+    barrier = threading.Event()
+
+    def worker():
+        barrier.wait()
+        gethostbyname('fresh.machine.example.org')
+
+    threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    start = time.time()
+    barrier.set()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 10, 50, 100, 200])
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds spent by the fake upstream resolver per lookup')
+    args = parser.parse_args()
+
+    print('%8s %16s %16s %12s' % ('threads', 'naive upstream', 'cache upstream', 'cache time'))
+    original = cache._gethostbyname
+    try:
+        for thread_count in args.threads:
+            naive_resolver = FakeResolver(args.latency)
+            run(thread_count, naive_gethostbyname(naive_resolver, {}))
+
+            resolver = FakeResolver(args.latency)
+            cache._gethostbyname = resolver
+            cache.clear()
+            elapsed = run(thread_count, cache.gethostbyname)
+
+            print('%8d %16d %16d %11.3fs' % (thread_count, naive_resolver.calls, resolver.calls, elapsed))
+    finally:
+        cache._gethostbyname = original
+        cache.clear()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare the stock socket functions with the patched ones.
+
+A fake resolver stands in for the system one, with an injected latency, and
+connections go to a loopback listener, so no network is needed.  Results are
+printed as JSON, one object per case, or as a table.
+
+    python -m benchmarks.socket_paths --latency 0.001 --threads 1 8 --format table
+"""
+
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import random
+import socket
+import sys
+import threading
+import time
+
+from hostsresolver import cache
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+FUNCTIONS = ('getaddrinfo', 'gethostbyname', 'create_connection', 'connect', 'connect_ex')
+MODES = ('stock', 'patched')
+
+
+class FakeResolver(object):
+    """Resolve every name to the loopback address after ``latency`` seconds.
+
+    Numeric addresses are answered at once, as real resolvers do.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _lookup(self, host):
+        if host.replace('.', '').isdigit():
+            return
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+    def gethostbyname(self, host):
+        self._lookup(host)
+        return '127.0.0.1'
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        self._lookup(host)
+        return [(socket.AF_INET, type or socket.SOCK_STREAM, proto or 6, '', ('127.0.0.1', port))]
+
+
+class Listener(object):
+    """Accept and close connections on a loopback port."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(socket.SOMAXCONN)
+        self.port = self.sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except socket.error:
+                return
+            connection.close()
+
+    def close(self):
+        self.sock.close()
+
+
+def _connect(sock_type, resolve, port, use_connect_ex=False):
+    def operation(host):
+        sock = sock_type(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            address = (resolve(host), port)
+            if use_connect_ex:
+                sock.connect_ex(address)
+            else:
+                sock.connect(address)
+        finally:
+            sock.close()
+    return operation
+
+
+def operations(mode, resolver, port):
+    """The operation run for each function, given a hostname."""
+    if mode == 'stock':
+        # The stock socket type resolves in C, the fake resolver is called
+        # first to stand in for the system resolver.
+        return {
+            'getaddrinfo': lambda host: resolver.getaddrinfo(host, port),
+            'gethostbyname': resolver.gethostbyname,
+            'create_connection': lambda host: socket.create_connection((host, port)).close(),
+            'connect': _connect(cache._SocketType, resolver.gethostbyname, port),
+            'connect_ex': _connect(cache._SocketType, resolver.gethostbyname, port, use_connect_ex=True),
+        }
+    return {
+        'getaddrinfo': lambda host: cache.getaddrinfo(host, port),
+        'gethostbyname': cache.gethostbyname,
+        'create_connection': lambda host: cache.create_connection((host, port)).close(),
+        'connect': _connect(cache.SocketType, lambda host: host, port),
+        'connect_ex': _connect(cache.SocketType, lambda host: host, port, use_connect_ex=True),
+    }
+
+
+def names(count, hit_ratio, hosts, seed=0):
+    """Names to look up, overridden ones with the ``hit_ratio`` probability."""
+    generator = random.Random(seed)
+    misses = itertools.count()
+    result = []
+    for _ in range(count):
+        if generator.random() < hit_ratio:
+            result.append('host%d.bench.test' % generator.randrange(hosts))
+        else:
+            result.append('miss%d.bench.test' % next(misses))
+    return result
+
+
+def run(operation, hosts, thread_count):
+    durations = []
+    lock = threading.Lock()
+    start_event = threading.Event()
+
+    def worker(chunk):
+        timings = []
+        start_event.wait()
+        for host in chunk:
+            start = _timer()
+            operation(host)
+            timings.append(_timer() - start)
+        with lock:
+            durations.extend(timings)
+
+    threads = [threading.Thread(target=worker, args=(hosts[index::thread_count],))
+               for index in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    start = _timer()
+    start_event.set()
+    for thread in threads:
+        thread.join()
+    return _timer() - start, sorted(durations)
+
+
+def _percentile(durations, fraction):
+    return durations[min(len(durations) - 1, int(len(durations) * fraction))]
+
+
+def benchmark(function, mode, hit_ratio, thread_count, hosts_size, operation_count, latency, port):
+    resolver = FakeResolver(latency)
+    saved = (socket.getaddrinfo, cache._getaddrinfo, cache._gethostbyname)
+    cache.clear()
+    cache.update(dict(('host%d.bench.test' % index, '127.0.0.1') for index in range(hosts_size)))
+    # socket.create_connection resolves through socket.getaddrinfo.
+    socket.getaddrinfo = resolver.getaddrinfo
+    cache._getaddrinfo = resolver.getaddrinfo
+    cache._gethostbyname = resolver.gethostbyname
+    try:
+        operation = operations(mode, resolver, port)[function]
+        elapsed, durations = run(operation, names(operation_count, hit_ratio, hosts_size), thread_count)
+    finally:
+        socket.getaddrinfo, cache._getaddrinfo, cache._gethostbyname = saved
+        cache.clear()
+    return {
+        'function': function,
+        'mode': mode,
+        'hit_ratio': hit_ratio,
+        'threads': thread_count,
+        'hosts': hosts_size,
+        'operations': operation_count,
+        'latency': latency,
+        'seconds': elapsed,
+        'operations_per_second': operation_count / elapsed,
+        'p50_us': _percentile(durations, 0.5) * 1e6,
+        'p99_us': _percentile(durations, 0.99) * 1e6,
+        'upstream_calls': resolver.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--functions', nargs='+', choices=FUNCTIONS, default=list(FUNCTIONS))
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--hit-ratios', type=float, nargs='+', default=[0.0, 0.9, 1.0])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--hosts', type=int, nargs='+', default=[100, 10000],
+                        help='number of overridden names, as loaded from a hosts file')
+    parser.add_argument('--operations', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.001,
+                        help='seconds spent by the fake resolver per lookup')
+    parser.add_argument('--format', choices=('json', 'table'), default='json')
+    parser.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout)
+    args = parser.parse_args()
+
+    listener = Listener()
+    try:
+        if args.format == 'table':
+            print('%-18s %-8s %5s %7s %6s %12s %10s %10s %9s' % (
+                'function', 'mode', 'hits', 'threads', 'hosts', 'ops/s', 'p50 us', 'p99 us', 'upstream'),
+                file=args.output)
+        for function, mode, hit_ratio, thread_count, hosts_size in itertools.product(
+                args.functions, args.modes, args.hit_ratios, args.threads, args.hosts):
+            result = benchmark(function, mode, hit_ratio, thread_count, hosts_size, args.operations,
+                               args.latency, listener.port)
+            if args.format == 'json':
+                print(json.dumps(result, sort_keys=True), file=args.output)
+            else:
+                print('%-18s %-8s %5.2f %7d %6d %12.0f %10.1f %10.1f %9d' % (
+                    function, mode, hit_ratio, thread_count, hosts_size, result['operations_per_second'],
+                    result['p50_us'], result['p99_us'], result['upstream_calls']), file=args.output)
+    finally:
+        listener.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-socket cost of each install strategy.
+
+Sockets are created through socket.SocketType, which is what install()
+replaces, then connected to a loopback listener by address.
+
+    python -m benchmarks.socket_type --number 20000
+"""
+
+import argparse
+import socket
+import timeit
+
+from benchmarks.socket_paths import Listener
+from hostsresolver import cache
+
+STRATEGIES = (
+    ('stock', None),
+    ('socket type', lambda: cache.install()),
+    ('resolution only', lambda: cache.install(socket_type=False)),
+)
+
+
+def create():
+    socket.SocketType(socket.AF_INET, socket.SOCK_STREAM).close()
+
+
+def connect(address):
+    sock = socket.SocketType(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    finally:
+        sock.close()
+
+
+def measure(function, number, repeat):
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000)
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    listener = Listener()
+    address = ('127.0.0.1', listener.port)
+    print('%-16s %12s %12s' % ('strategy', 'create us', 'connect us'))
+    try:
+        for name, install in STRATEGIES:
+            cache.uninstall()
+            if install is not None:
+                install()
+            print('%-16s %12.2f %12.2f' % (
+                name, measure(create, args.number, args.repeat),
+                measure(lambda: connect(address), args.connections, args.repeat)))
+    finally:
+        cache.uninstall()
+        listener.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import weakref
+
+from hostsresolver import cache
+
+_getaddrinfo = asyncio.BaseEventLoop.getaddrinfo
+
+# Lookups running in the executor, per loop, so that concurrent misses for
+# the same arguments wait on a single future.
+_pending = weakref.WeakKeyDictionary()
+
+
+async def getaddrinfo(self, host, port, *, family=0, type=0, proto=0, flags=0):
+    result = cache.cached_getaddrinfo(host, port, family, type, proto, flags)
+    if result is not None:
+        return result
+
+    key = (host, port, family, type, proto, flags)
+    pending = _pending.setdefault(self, {})
+    future = pending.get(key)
+    if future is None:
+        future = self.run_in_executor(None, cache.getaddrinfo, *key)
+        pending[key] = future
+        future.add_done_callback(lambda _: pending.pop(key, None))
+    # A cancelled caller must not cancel the lookup the others wait on.
+    return list(await asyncio.shield(future))
+
+
+def install(loop=None):
+    """Resolve through the host cache in asyncio event loops.
+
+    Loop methods such as create_connection() and sock_connect() resolve
+    through loop.getaddrinfo(), which is patched for every loop derived from
+    asyncio.BaseEventLoop, or only for ``loop`` when given.  Cache hits and
+    overrides are answered on the loop, misses run in the default executor.
+    """
+    if loop is not None:
+        loop.getaddrinfo = getaddrinfo.__get__(loop)
+    else:
+        asyncio.BaseEventLoop.getaddrinfo = getaddrinfo
+
+
+def uninstall(loop=None):
+    if loop is not None:
+        loop.__dict__.pop('getaddrinfo', None)
+    else:
+        asyncio.BaseEventLoop.getaddrinfo = _getaddrinfo
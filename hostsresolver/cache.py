@@ -12,36 +12,556 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+import itertools
 import socket
 import sys
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+from hostsresolver.watch import Poller
+
+# The socket module functions, restored by uninstall().  The resolver
+# references below may be wrapped, by instrumentation for example.
+_stock_getaddrinfo = socket.getaddrinfo
+_stock_gethostbyname = socket.gethostbyname
 
 _getaddrinfo = socket.getaddrinfo
+# Resolves override addresses, never names, kept apart from the real resolver.
+_numeric_getaddrinfo = socket.getaddrinfo
 _gethostbyname = socket.gethostbyname
 _SocketType = socket.SocketType
 _create_connection = socket.create_connection
 
+_clock = getattr(time, 'monotonic', time.time)
+
+try:
+    _ExceptionGroup = ExceptionGroup
+except NameError:
+    _ExceptionGroup = None
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_SIZE = 1024
+DEFAULT_NEGATIVE_TTL = 5
+DEFAULT_LAYER = 'default'
+DEFAULT_PRIORITY = 0
+# Delay between connection attempts to the addresses of a name, from RFC 8305.
+DEFAULT_CONNECTION_ATTEMPT_DELAY = 0.25
+DEFAULT_PREWARM_WORKERS = 16
+DEFAULT_PREWARM_TIMEOUT = 10
+
+_UNSET = object()
+
+
+class ExpiringLRUCache(object):
+    """Bounded mapping whose entries expire ``ttl`` seconds after being set.
+
+    A ``ttl`` of None keeps entries until they are evicted, a ``max_size`` of
+    None never evicts.  When full, the least recently used entry is dropped.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        try:
+            self.get(key)
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self._entries.pop(key)
+            if expires_at is not None and expires_at <= _clock():
+                raise KeyError(key)
+            self._entries[key] = (value, expires_at)
+            return value
+
+    def set(self, key, value, ttl=_UNSET):
+        ttl = self.ttl if ttl is _UNSET else ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, None if ttl is None else _clock() + ttl)
+            self._evict()
+
+    def resize(self, max_size):
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self):
+        if self.max_size is None:
+            return
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls sharing the same key.
+
+    The first caller runs the function, the ones arriving while it runs wait
+    for it and get the same result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+# Merged index of the overrides of every layer, given through update() and
+# replace().  They are pinned, names learned from the real resolver expire
+# and are evicted once the cache is full.
 _hosts_cache = {}
+# Suffix rules such as ``*.svc.test`` live in a trie keyed by the labels from
+# the right, a lookup costs one step per label whatever the number of rules.
+_suffix_index = {}
+# Read-only tables published by other processes, consulted after the layers.
+_shared_tables = []
+_resolved_cache = ExpiringLRUCache()
+_addrinfo_cache = ExpiringLRUCache()
+# Failed lookups are remembered briefly so that a bad name does not hit the
+# real resolver on every connection attempt.
+_failed_cache = ExpiringLRUCache(ttl=DEFAULT_NEGATIVE_TTL)
 
+# Address each name was last connected to, tried first the next time.
+_last_connected = ExpiringLRUCache(ttl=None)
 
-def gethostbyname(host):
+_lookups = SingleFlight()
+
+# Guards changes to the overrides.  Lookups remember the generation they
+# started in and drop their result if the overrides changed meanwhile.
+_lock = threading.RLock()
+_generation = 0
+
+# On Python 2 hostnames may be either str or unicode, bytes are not hostnames
+# on Python 3.
+_text_types = (type(u''), str)
+
+# Hosts given through overlay(), for the current context only.  They come
+# before everything else and are never cached.
+if contextvars is not None:
+    _overlay = contextvars.ContextVar('hostsresolver_overlay', default=None)
+    _current_overlay = _overlay.get
+    _push_overlay = _overlay.set
+    _pop_overlay = _overlay.reset
+else:
+    _overlay = threading.local()
+
+    def _current_overlay():
+        return getattr(_overlay, 'hosts', None)
+
+    def _push_overlay(hosts):
+        previous = _current_overlay()
+        _overlay.hosts = hosts
+        return previous
+
+    def _pop_overlay(previous):
+        _overlay.hosts = previous
+
+
+def _is_ipv4_literal(host):
+    if not host[-1:].isdigit():
+        return False
+    try:
+        socket.inet_pton(socket.AF_INET, host)
+    except (socket.error, ValueError):
+        return False
+    return True
+
+
+def _is_hostname(host):
+    if not isinstance(host, _text_types) or not host:
+        return False
+    # Unix socket paths (abstract ones start with a null byte) and IPv6
+    # literals can never be hostnames.
+    if '/' in host or ':' in host or host[0] == '\0':
+        return False
+    return not _is_ipv4_literal(host)
+
+
+def _is_suffix_rule(name):
+    return name.startswith('.')
+
+
+def _normalize(hosts):
+    # '*.svc.test' and '.svc.test' are the same rule, domains are not case
+    # sensitive.
+    normalized = {}
+    for name, address in dict(hosts).items():
+        if name.startswith('*.'):
+            name = name[1:]
+        if _is_suffix_rule(name):
+            name = name.lower().rstrip('.')
+        normalized[name] = address
+    return normalized
+
+
+def _match_suffix(host):
+    labels = host.lower().rstrip('.').split('.')
+    node = _suffix_index
+    address = None
+    # The leftmost label is never walked, a rule only covers subdomains and
+    # the deepest one matching wins.
+    for label in labels[:0:-1]:
+        node = node.get(label)
+        if node is None:
+            break
+        address = node.get(None, address)
+    return address
+
+
+def _override(host, blocking=True):
     try:
         return _hosts_cache[host]
     except KeyError:
-        _hosts_cache[host] = _gethostbyname(host)
-    return _hosts_cache[host]
+        pass
+    for table in _shared_tables:
+        # Tables resolving names on demand answer from what they know with
+        # peek(), which never blocks.
+        address = table.get(host) if blocking else getattr(table, 'peek', table.get)(host)
+        if address is not None:
+            return address
+    if _suffix_index and isinstance(host, _text_types):
+        return _match_suffix(host)
+    return None
+
+
+def _resolve_on_demand(host):
+    # Tables with peek() resolve the names they do not know yet on get().
+    for table in _shared_tables:
+        if hasattr(table, 'peek'):
+            address = table.get(host)
+            if address is not None:
+                return address
+    return None
+
+
+def lookup_override(host, blocking=True):
+    """Return the address overriding ``host``, exactly or through a rule.
+
+    With ``blocking`` False, attached tables not knowing the address yet
+    are not asked to resolve it.
+    """
+    if not _is_hostname(host):
+        return None
+    overlay = _current_overlay()
+    if overlay is not None and host in overlay:
+        return overlay[host]
+    return _override(host, blocking)
+
+
+def _ipv4_override(address):
+    # gethostbyname() only gives IPv4 addresses, names overridden with an
+    # IPv6 one are resolved through getaddrinfo().
+    if ':' in address:
+        raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+    return address
+
+
+def gethostbyname(host):
+    overlay = _current_overlay()
+    if overlay is not None and host in overlay:
+        return _ipv4_override(overlay[host])
+    address = _override(host)
+    if address is not None:
+        return _ipv4_override(address)
+    try:
+        return _resolved_cache.get(host)
+    except KeyError:
+        pass
+    if isinstance(host, _text_types) and _is_ipv4_literal(host):
+        return host
+    try:
+        raise socket.gaierror(*_failed_cache.get(host))
+    except KeyError:
+        pass
+    return _lookups.do(host, _resolve_hostname, host)
+
+
+def cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    """Answer like getaddrinfo() without ever asking the real resolver.
+
+    Returns None when the answer is neither cached nor overridden.
+    """
+    overlay = _current_overlay()
+    if overlay is not None and host in overlay:
+        return _numeric_getaddrinfo(overlay[host], port, family, type, proto, flags | socket.AI_NUMERICHOST)
+    key = (host, port, family, type, proto, flags)
+    try:
+        return list(_addrinfo_cache.get(key))
+    except KeyError:
+        pass
+    if not _is_hostname(host):
+        return None
+    try:
+        raise socket.gaierror(*_failed_cache.get(key))
+    except KeyError:
+        pass
+    override = _override(host, blocking=False)
+    if override is not None:
+        # Overrides are resolved numerically, this never blocks.
+        return list(_lookups.do(key, _resolve_addrinfo, key, override))
+    return None
+
+
+def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    result = cached_getaddrinfo(host, port, family, type, proto, flags)
+    if result is not None:
+        return result
+    if not _is_hostname(host):
+        return _getaddrinfo(host, port, family, type, proto, flags)
+    key = (host, port, family, type, proto, flags)
+    return list(_lookups.do(key, _resolve_addrinfo, key, _resolve_on_demand(host)))
+
+
+def _store(cache, key, value, generation):
+    with _lock:
+        if generation == _generation:
+            cache.set(key, value)
+
+
+def _resolve_hostname(host):
+    generation = _generation
+    try:
+        address = _gethostbyname(host)
+    except socket.gaierror as e:
+        _store(_failed_cache, host, e.args, generation)
+        raise
+    _store(_resolved_cache, host, address, generation)
+    return address
+
+
+def _resolve_addrinfo(key, override=None):
+    generation = _generation
+    host, port, family, type, proto, flags = key
+    try:
+        if override is not None:
+            result = _numeric_getaddrinfo(override, port, family, type, proto, flags | socket.AI_NUMERICHOST)
+        else:
+            result = _getaddrinfo(host, port, family, type, proto, flags)
+    except socket.gaierror as e:
+        _store(_failed_cache, key, e.args, generation)
+        raise
+    _store(_addrinfo_cache, key, result, generation)
+    return result
+
+
+def _connection_candidates(host, port):
+    infos = []
+    seen = set()
+    for info in getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        if info[4][0] not in seen:
+            seen.add(info[4][0])
+            infos.append(info)
+
+    # Families are interleaved, starting with the preferred one, so that a
+    # broken family does not delay the other one for long.
+    families = []
+    for info in infos:
+        if info[0] not in families:
+            families.append(info[0])
+    by_family = [[info for info in infos if info[0] == family] for family in families]
+    ordered = [info for group in _interleave(by_family) for info in group]
+
+    try:
+        last = _last_connected.get(host)
+    except KeyError:
+        return ordered
+    return sorted(ordered, key=lambda info: info[4][0] != last)
+
+
+def _interleave(lists):
+    for index in range(max(len(values) for values in lists) if lists else 0):
+        yield [values[index] for values in lists if index < len(values)]
+
+
+def _connect_attempt(info, timeout, source_address):
+    family, type, proto, _, sockaddr = info
+    sock = socket.socket(family, type, proto)
+    try:
+        if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            sock.settimeout(timeout)
+        if source_address:
+            sock.bind(source_address)
+        sock.connect(sockaddr)
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def _close_late_connections(results, count):
+    for _ in range(count):
+        sock = results.get()[1]
+        if sock is not None:
+            sock.close()
 
 
-def getaddrinfo(host, port, *args, **kwargs):
-    return _getaddrinfo(gethostbyname(host), port, *args, **kwargs)
+def _connection_error(errors, all_errors):
+    if all_errors and _ExceptionGroup is not None:
+        return _ExceptionGroup('create_connection failed', errors)
+    return errors[-1]
 
 
-def create_connection(address, *args, **kwargs):
-    host, port = address
-    return _create_connection((gethostbyname(host), port), *args, **kwargs)
+def _happy_eyeballs(infos, timeout, source_address, delay, all_errors=False):
+    # Attempts start ``delay`` seconds apart, or as soon as the previous one
+    # failed, the first one to connect wins.
+    results = queue.Queue()
+
+    def attempt(info):
+        try:
+            results.put((info, _connect_attempt(info, timeout, source_address), None))
+        except Exception as e:
+            results.put((info, None, e))
+
+    pending = list(infos)
+    running = 0
+    errors = []
+    while pending or running:
+        if pending:
+            thread = threading.Thread(target=attempt, args=(pending.pop(0),))
+            thread.daemon = True
+            thread.start()
+            running += 1
+        try:
+            info, sock, e = results.get(timeout=delay if pending else None)
+        except queue.Empty:
+            continue
+        running -= 1
+        if sock is not None:
+            if running:
+                closer = threading.Thread(target=_close_late_connections, args=(results, running))
+                closer.daemon = True
+                closer.start()
+            return info, sock
+        errors.append(e)
+    raise _connection_error(errors, all_errors)
+
+
+def create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None,
+                      attempt_delay=DEFAULT_CONNECTION_ATTEMPT_DELAY, all_errors=False):
+    """Connect to every address of the host, one after the other but without
+    waiting for each attempt to fail, as described by RFC 8305.
+
+    The address connected to is tried first the next time.  As with the
+    stock function, ``all_errors`` raises an ExceptionGroup of every
+    failed attempt, where available, instead of the last one.
+    """
+    host, port = address[:2]
+    infos = _connection_candidates(host, port)
+    if not infos:
+        raise socket.error('getaddrinfo returns an empty list')
+    if len(infos) == 1:
+        try:
+            return _connect_attempt(infos[0], timeout, source_address)
+        except Exception as e:
+            raise _connection_error([e], all_errors)
+    info, sock = _happy_eyeballs(infos, timeout, source_address, attempt_delay, all_errors)
+    _last_connected.set(host, info[4][0])
+    return sock
+
+
+def prewarm(hosts, port=None, workers=DEFAULT_PREWARM_WORKERS, timeout=DEFAULT_PREWARM_TIMEOUT):
+    """Resolve the hosts in parallel, and connect to them when given a port.
+
+    ``hosts`` are names or (name, port) pairs.  Returns the address of each
+    name, None for the ones that could not be resolved or connected to
+    within ``timeout`` seconds.
+    """
+    from concurrent import futures
+
+    def warm(host):
+        name, host_port = host if isinstance(host, tuple) else (host, port)
+        if host_port is None:
+            return name, getaddrinfo(name, None, 0, socket.SOCK_STREAM)[0][4][0]
+        sock = create_connection((name, host_port), timeout)
+        try:
+            return name, sock.getpeername()[0]
+        finally:
+            sock.close()
+
+    hosts = list(hosts)
+    addresses = {}
+    if not hosts:
+        return addresses
+    executor = futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(hosts))))
+    submitted = [(host, executor.submit(warm, host)) for host in hosts]
+    try:
+        futures.wait([future for _, future in submitted], timeout)
+        for host, future in submitted:
+            name = host[0] if isinstance(host, tuple) else host
+            try:
+                addresses[name] = future.result()[1] if future.done() else None
+            except (socket.error, IndexError):
+                addresses[name] = None
+    finally:
+        # Hosts not started yet are dropped, the ones being warmed are left to
+        # finish in the background.
+        for _, future in submitted:
+            future.cancel()
+        executor.shutdown(wait=False)
+    return addresses
 
 
 class SocketType(_SocketType):
     def _use_host_cache(self, address):
+        if self.family != socket.AF_INET or not isinstance(address, tuple) or not _is_hostname(address[0]):
+            return address
         try:
             return (gethostbyname(address[0]), address[1])
         except socket.gaierror:
@@ -56,36 +576,376 @@ class SocketType(_SocketType):
         return _SocketType.connect_ex(self, self._use_host_cache(address))
 
 
-def update(hosts):
-    _hosts_cache.update(hosts)
+class Layer(object):
+    """A named set of overrides, such as the names loaded from one source.
+
+    When names are given by several layers, the one with the highest
+    ``priority`` wins, the last registered one among equals.  A layer with a
+    ``loader`` can be refreshed, every ``refresh_interval`` seconds if given.
+    """
+
+    def __init__(self, name, priority=DEFAULT_PRIORITY, loader=None):
+        self.name = name
+        self.priority = priority
+        self.loader = loader
+        self.hosts = {}
+        self.poller = None
+        self.order = next(_registrations)
+
+    def __repr__(self):
+        return '<Layer {} priority={} names={}>'.format(self.name, self.priority, len(self.hosts))
+
+
+# Layers from the highest precedence to the lowest
+_layers = []
+_registrations = itertools.count()
+
+
+def _invalidate(removed=False):
+    global _generation
+    # Cached results may predate the new overrides.
+    _addrinfo_cache.clear()
+    _failed_cache.clear()
+    if removed:
+        _resolved_cache.clear()
+    _generation += 1
+
+
+def _set_suffix(rule, address):
+    node = _suffix_index
+    for label in reversed(rule[1:].split('.')):
+        node = node.setdefault(label, {})
+    node[None] = address
+
+
+def _remove_suffix(rule):
+    path = [_suffix_index]
+    labels = list(reversed(rule[1:].split('.')))
+    for label in labels:
+        node = path[-1].get(label)
+        if node is None:
+            return
+        path.append(node)
+    path[-1].pop(None, None)
+    # Prune the branches left empty, from the leaf up.
+    for label, node in zip(reversed(labels), reversed(path[:-1])):
+        if node[label]:
+            break
+        del node[label]
+
+
+def _reindex(names):
+    # The merged index is kept up to date in place, lookups never see a name
+    # missing while it moves from one layer to another.
+    for name in names:
+        rule = _is_suffix_rule(name)
+        for layer in _layers:
+            if name in layer.hosts:
+                if rule:
+                    _set_suffix(name, layer.hosts[name])
+                else:
+                    _hosts_cache[name] = layer.hosts[name]
+                break
+        else:
+            if rule:
+                _remove_suffix(name)
+            else:
+                _hosts_cache.pop(name, None)
+
+
+def _sort_layers():
+    _layers.sort(key=lambda layer: (layer.priority, layer.order), reverse=True)
+
+
+def _find_layer(name):
+    for layer in _layers:
+        if layer.name == name:
+            return layer
+    return None
+
+
+def _layer(name):
+    layer = _find_layer(name)
+    return register(name) if layer is None else layer
+
+
+def _stop(poller):
+    # Pollers are stopped without holding the lock, which their refresh needs.
+    if poller is not None:
+        poller.stop()
+
+
+def register(name, priority=_UNSET, loader=_UNSET, refresh_interval=_UNSET, jitter=0):
+    """Add the ``name`` layer, or change its settings if it already exists.
+
+    A ``loader`` returns the layer's hosts, it is called right away and then
+    on refresh().  Settings that are not given keep their current value.
+    """
+    with _lock:
+        layer = _find_layer(name)
+        if layer is None:
+            layer = Layer(name)
+            _layers.append(layer)
+        if priority is not _UNSET:
+            layer.priority = priority
+        if loader is not _UNSET:
+            layer.loader = loader
+        poller = None
+        if refresh_interval is not _UNSET:
+            poller, layer.poller = layer.poller, None
+        _sort_layers()
+        _reindex(layer.hosts)
+        _invalidate()
+    _stop(poller)
+
+    if loader is not _UNSET and loader is not None:
+        refresh(name)
+    if refresh_interval is not _UNSET and refresh_interval is not None and layer.loader is not None:
+        layer.poller = Poller(lambda: refresh(name), refresh_interval, jitter,
+                              name='hostsresolver-refresh-{}'.format(name))
+        layer.poller.start()
+    return layer
+
+
+def unregister(name):
+    with _lock:
+        layer = _find_layer(name)
+        if layer is None:
+            return
+        _layers.remove(layer)
+        _reindex(layer.hosts)
+        _invalidate(removed=True)
+    _stop(layer.poller)
+
+
+def layers():
+    return list(_layers)
+
+
+def refresh(name):
+    """Load the hosts of the ``name`` layer again, leaving the others alone.
+
+    A loader returning None leaves the layer as it is.
+    """
+    layer = _find_layer(name)
+    if layer is None or layer.loader is None:
+        return
+    hosts = layer.loader()
+    if hosts is None:
+        return
+    with _lock:
+        # The layer may have been removed while loading.
+        if _find_layer(name) is layer:
+            replace(hosts, layer=name)
+
+
+def update(hosts, layer=DEFAULT_LAYER):
+    """Add the hosts to a layer, which is created as needed.
+
+    A name starting with ``*.`` or ``.`` is a rule covering every subdomain,
+    names given exactly take precedence over rules.
+    """
+    hosts = _normalize(hosts)
+    with _lock:
+        target = _layer(layer)
+        target.hosts.update(hosts)
+        _reindex(hosts)
+        _invalidate()
+
+
+def replace(hosts, layer=DEFAULT_LAYER):
+    """Swap the whole content of a layer for ``hosts`` in a single step."""
+    hosts = _normalize(hosts)
+    with _lock:
+        target = _layer(layer)
+        previous, target.hosts = target.hosts, hosts
+        removed = [name for name in previous if name not in target.hosts]
+        _reindex(removed)
+        _reindex(target.hosts)
+        _invalidate(removed=bool(removed))
+
+
+def overrides():
+    """Return the names overridden exactly, merged across the layers."""
+    with _lock:
+        return dict(_hosts_cache)
+
+
+def _table_changed():
+    with _lock:
+        _invalidate(removed=True)
+
+
+def attach(table):
+    """Look names up in ``table``, a mapping such as a shared_table.SharedTable.
+
+    A table whose get() may block also has a ``peek(name)`` method, used by
+    cached_getaddrinfo(), returning only the addresses it already knows.
+    """
+    with _lock:
+        _shared_tables.append(table)
+        if hasattr(table, 'on_change'):
+            table.on_change = _table_changed
+        _invalidate()
+
+
+def detach(table):
+    with _lock:
+        # Mappings compare by content, tables are told apart by identity.
+        _shared_tables[:] = [attached for attached in _shared_tables if attached is not table]
+        _invalidate(removed=True)
 
 
 def clear():
-    _hosts_cache.clear()
+    with _lock:
+        pollers = [layer.poller for layer in _layers]
+        del _layers[:]
+        del _shared_tables[:]
+        _hosts_cache.clear()
+        _suffix_index.clear()
+        _last_connected.clear()
+        _invalidate(removed=True)
+    for poller in pollers:
+        _stop(poller)
+
+
+def configure(ttl=_UNSET, max_size=_UNSET, negative_ttl=_UNSET):
+    """Tune the cache of names looked up with the real resolver.
+
+    ``ttl`` is the lifetime in seconds of a learned entry (None never expires)
+    and ``max_size`` the number of learned entries kept (None is unbounded).
+    ``negative_ttl`` is how long a failed lookup keeps failing without asking
+    the real resolver again.  Arguments that are not given keep their current
+    value.
+    """
+    if ttl is not _UNSET:
+        _resolved_cache.ttl = ttl
+        _addrinfo_cache.ttl = ttl
+    if max_size is not _UNSET:
+        _resolved_cache.resize(max_size)
+        _addrinfo_cache.resize(max_size)
+        _failed_cache.resize(max_size)
+        _last_connected.resize(max_size)
+    if negative_ttl is not _UNSET:
+        _failed_cache.ttl = negative_ttl
+
 
+def _patch_socket_type(socket_type):
+    socket.SocketType = socket_type
+    if sys.version_info > (3,):
+        import _socket
+        _socket.socket = socket_type
+    else:
+        socket.socket = socket_type
 
-def install():
-    if socket.getaddrinfo is getaddrinfo:
-        return  # Already installed
 
+def install(ttl=_UNSET, max_size=_UNSET, negative_ttl=_UNSET, socket_type=_UNSET, prewarm_hosts=None,
+            prewarm_timeout=DEFAULT_PREWARM_TIMEOUT):
+    """Resolve names through the cache in the socket module.
+
+    With ``socket_type`` False only the name resolution functions are
+    patched, getaddrinfo(), gethostbyname() and create_connection(), and
+    sockets keep their C type.  Sockets connecting to a hostname themselves
+    then bypass the cache.  When not given, an installed cache keeps its
+    choice and a first install patches sockets too.  ``prewarm_hosts`` are
+    given to prewarm() with ``prewarm_timeout``.
+    """
+    configure(ttl=ttl, max_size=max_size, negative_ttl=negative_ttl)
+    if socket_type is _UNSET:
+        socket_type = socket.getaddrinfo is not getaddrinfo or socket.SocketType is SocketType
     socket.getaddrinfo = getaddrinfo
     socket.gethostbyname = gethostbyname
-    socket.SocketType = SocketType
     socket.create_connection = create_connection
+    _patch_socket_type(SocketType if socket_type else _SocketType)
+    if prewarm_hosts:
+        prewarm(prewarm_hosts, timeout=prewarm_timeout)
+
+
+def uninstall():
+    socket.getaddrinfo = _stock_getaddrinfo
+    socket.gethostbyname = _stock_gethostbyname
+    socket.create_connection = _create_connection
+    _patch_socket_type(_SocketType)
+
+
+def _socket_state():
     if sys.version_info > (3,):
         import _socket
-        _socket.socket = SocketType
+        socket_type = _socket.socket
     else:
-        socket.socket = SocketType
+        socket_type = socket.socket
+    return (socket.getaddrinfo, socket.gethostbyname, socket.create_connection, socket.SocketType,
+            socket_type)
 
 
-def uninstall():
-    socket.getaddrinfo = _getaddrinfo
-    socket.gethostbyname = _gethostbyname
-    socket.SocketType = _SocketType
-    socket.create_connection = _create_connection
+def _restore_socket_state(state):
+    socket.getaddrinfo, socket.gethostbyname, socket.create_connection, socket.SocketType, socket_type = state
     if sys.version_info > (3,):
         import _socket
-        _socket.socket = _SocketType
+        _socket.socket = socket_type
     else:
-        socket.socket = SocketType
+        socket.socket = socket_type
+
+
+class _Scope(object):
+    def __call__(self, function):
+        @functools.wraps(function)
+        def scoped(*args, **kwargs):
+            # A fresh scope per call, calls may run concurrently.
+            with self._copy():
+                return function(*args, **kwargs)
+        return scoped
+
+
+class _Installed(_Scope):
+    def __init__(self, kwargs):
+        self.kwargs = kwargs
+        self._state = None
+
+    def _copy(self):
+        return _Installed(self.kwargs)
+
+    def __enter__(self):
+        self._state = _socket_state()
+        install(**self.kwargs)
+        return self
+
+    def __exit__(self, *exc_info):
+        _restore_socket_state(self._state)
+
+
+class _Overlay(_Scope):
+    def __init__(self, hosts):
+        self.hosts = dict(hosts)
+        self._token = None
+
+    def _copy(self):
+        return _Overlay(self.hosts)
+
+    def __enter__(self):
+        hosts = dict(_current_overlay() or {})
+        hosts.update(self.hosts)
+        self._token = _push_overlay(hosts)
+        return self
+
+    def __exit__(self, *exc_info):
+        _pop_overlay(self._token)
+
+
+def installed(**kwargs):
+    """Context manager or decorator installing the cache for its duration.
+
+    Takes the arguments of install().  The socket module is left as it was
+    found on exit, patched or not.
+    """
+    return _Installed(kwargs)
+
+
+def overlay(hosts):
+    """Context manager or decorator resolving ``hosts`` in its scope only.
+
+    The scope is the current thread or asyncio task, so concurrent tests may
+    resolve the same name differently.  Overlays nest, and come before the
+    layers.  They are used by the patched socket module, see install().
+    """
+    return _Overlay(hosts)
@@ -0,0 +1,246 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Load the sources from a shell to resolve names, export them or time them.
+
+    hostsresolver --hosts-file hosts --vagrant . resolve < names
+    hostsresolver --vagrant . export --format binary --output hosts.table
+    hostsresolver --vagrant . --hostmanager . profile
+"""
+
+import argparse
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from vagrant import Vagrant
+
+from hostsresolver import cache, frozen_table, hostsfile_source, vagrant_hostmanager_source, vagrant_source
+
+FORMATS = ('hosts', 'json', 'binary')
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+class CommandTimer(object):
+    """Measure the time during which at least one Vagrant command runs.
+
+    Commands run concurrently by several workers are counted once, so the
+    time left to a source's load is spent parsing and merging.
+    """
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self.commands = 0
+        self._running = 0
+        self._started = None
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            self.commands += 1
+            self._running += 1
+            if self._running == 1:
+                self._started = _timer()
+
+    def _exit(self):
+        with self._lock:
+            self._running -= 1
+            if self._running == 0:
+                self.elapsed += _timer() - self._started
+
+    def __enter__(self):
+        run = self._run = Vagrant._run_vagrant_command
+
+        def timed(vagrant, args):
+            self._enter()
+            try:
+                return run(vagrant, args)
+            finally:
+                self._exit()
+
+        Vagrant._run_vagrant_command = timed
+        return self
+
+    def __exit__(self, *exc_info):
+        Vagrant._run_vagrant_command = self._run
+
+
+class Timing(object):
+    def __init__(self, layer, entries, total, subprocess, commands):
+        self.layer = layer
+        self.entries = entries
+        self.total = total
+        self.subprocess = subprocess
+        self.commands = commands
+
+    @property
+    def parse(self):
+        return self.total - self.subprocess
+
+
+def _loader(kind, args):
+    if kind == 'hostsfile':
+        return lambda path: hostsfile_source.known_hosts(path, skip_loopback=not args.keep_loopback)
+    if kind == 'vagrant':
+        return lambda root: vagrant_source.known_hosts(root, workers=args.workers, timeout=args.timeout,
+                                                       snapshot=args.snapshot or None)
+    names = vagrant_hostmanager_source.ALL_MACHINES if args.all_machines else None
+    return lambda root: vagrant_hostmanager_source.known_hosts(root, snapshot=args.snapshot or None, names=names,
+                                                               merge=args.all_machines, workers=args.workers,
+                                                               timeout=args.timeout)
+
+
+def _layer_name(kind, location):
+    if kind == 'hostsfile':
+        return hostsfile_source.layer_name(location)
+    if kind == 'vagrant':
+        return vagrant_source.layer_name(location)
+    return vagrant_source.layer_name(location, 'hostmanager')
+
+
+def load_sources(args):
+    """Load each source in its own layer, the ones given last winning, and
+    return how long each took."""
+    timings = []
+    for kind, location in args.sources or ():
+        layer = _layer_name(kind, location)
+        with CommandTimer() as commands:
+            start = _timer()
+            hosts = _loader(kind, args)(location)
+            total = _timer() - start
+        cache.replace(hosts, layer=layer)
+        timings.append(Timing(layer, len(hosts), total, commands.elapsed, commands.commands))
+    return timings
+
+
+def _names(stream):
+    # Read line by line so that names are answered as they come in.
+    for line in iter(stream.readline, ''):
+        name = line.split('#', 1)[0].strip()
+        if name:
+            yield name
+
+
+def _lookup(name):
+    # gethostbyname() only answers IPv4, overrides may be IPv6 addresses.
+    address = cache.lookup_override(name)
+    return cache.gethostbyname(name) if address is None else address
+
+
+def resolve(args, timings, stdin, stdout, stderr):
+    lookup = cache.lookup_override if args.overrides_only else _lookup
+    failed = False
+    for name in args.names or _names(stdin):
+        try:
+            address = lookup(name)
+        except (socket.error, UnicodeError) as e:
+            address, error = None, e
+        else:
+            error = 'not overridden'
+        if address is None:
+            failed = True
+            stderr.write('{}: {}\n'.format(name, error))
+        else:
+            stdout.write('{}\t{}\n'.format(address, name))
+        stdout.flush()
+    return 2 if failed else 0
+
+
+def export(args, timings, stdin, stdout, stderr):
+    hosts = cache.overrides()
+    if args.format == 'binary':
+        frozen_table.build(hosts).save(args.output)
+        return 0
+
+    if args.format == 'json':
+        content = json.dumps(hosts, indent=2, sort_keys=True) + '\n'
+    else:
+        content = ''.join('{}\t{}\n'.format(hosts[name], name) for name in sorted(hosts))
+    if args.output == '-':
+        stdout.write(content)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(content)
+    return 0
+
+
+def profile(args, timings, stdin, stdout, stderr):
+    row = '{:<50} {:>8} {:>9} {:>11} {:>9} {:>9}\n'
+    stdout.write(row.format('source', 'entries', 'total', 'subprocess', 'commands', 'parse'))
+    for timing in timings:
+        stdout.write(row.format(timing.layer, timing.entries, '{:.1f}ms'.format(timing.total * 1000),
+                                '{:.1f}ms'.format(timing.subprocess * 1000), timing.commands,
+                                '{:.1f}ms'.format(timing.parse * 1000)))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='hostsresolver', description=__doc__.splitlines()[0])
+    sources = parser.add_argument_group('sources', 'loaded in the order given, the last one winning')
+    sources.add_argument('--hosts-file', dest='sources', action='append', metavar='PATH',
+                         type=lambda path: ('hostsfile', path))
+    sources.add_argument('--vagrant', dest='sources', action='append', metavar='VAGRANT_ROOT',
+                         type=lambda root: ('vagrant', root))
+    sources.add_argument('--hostmanager', dest='sources', action='append', metavar='VAGRANT_ROOT',
+                         type=lambda root: ('hostmanager', root))
+    parser.add_argument('--keep-loopback', action='store_true', help='load the loopback entries of hosts files')
+    parser.add_argument('--all-machines', action='store_true',
+                        help='merge the hostmanager hosts of every machine instead of the first one')
+    parser.add_argument('--snapshot', action='store_true', help='reuse the Vagrant snapshots while still valid')
+    parser.add_argument('--workers', type=int, default=vagrant_source.DEFAULT_WORKERS)
+    parser.add_argument('--timeout', type=float, help='seconds given to each Vagrant machine')
+    parser.add_argument('--timings', action='store_true', help='print the time each source took to stderr')
+
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    command = commands.add_parser('resolve', help='resolve names given or read from stdin, one per line')
+    command.add_argument('names', nargs='*')
+    command.add_argument('--overrides-only', action='store_true', help='never ask the system resolver')
+    command.set_defaults(run=resolve)
+
+    command = commands.add_parser('export', help='write the names overridden by the sources')
+    command.add_argument('--format', choices=FORMATS, default='hosts')
+    command.add_argument('--output', default='-', help='file to write, stdout by default')
+    command.set_defaults(run=export)
+
+    command = commands.add_parser('profile', help='print the time each source took to load')
+    command.set_defaults(run=profile)
+    return parser
+
+
+def main(argv=None, stdin=None, stdout=None, stderr=None):
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'export' and args.format == 'binary' and args.output == '-':
+        parser.error('binary exports need an --output file')
+
+    # python-vagrant raises RuntimeError when the vagrant executable is missing.
+    try:
+        timings = load_sources(args)
+    except (IOError, OSError, RuntimeError, subprocess.CalledProcessError) as e:
+        parser.exit(1, '{}: could not load the sources: {}\n'.format(parser.prog, e))
+    if args.timings and args.run is not profile:
+        profile(args, timings, stdin, stderr, stderr)
+    return args.run(args, timings, stdin, stdout, stderr)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
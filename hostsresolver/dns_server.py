@@ -0,0 +1,393 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import socket
+import struct
+import threading
+from collections import namedtuple
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from hostsresolver import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = ('127.0.0.1', 5300)
+DEFAULT_TIMEOUT = 2
+# Local answers follow the overrides, which may change at any time.
+DEFAULT_ANSWER_TTL = 5
+DEFAULT_IDLE_TIMEOUT = 10
+RESOLV_CONF = '/etc/resolv.conf'
+
+TYPE_A = 1
+TYPE_AAAA = 28
+CLASS_IN = 1
+
+RCODE_NOERROR = 0
+RCODE_FORMERR = 1
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+
+_FLAG_RESPONSE = 0x8000
+_FLAG_AUTHORITATIVE = 0x0400
+_FLAG_TRUNCATED = 0x0200
+_FLAG_RECURSION_AVAILABLE = 0x0080
+# Opcode and recursion desired are echoed from the query.
+_FLAGS_ECHOED = 0x7900
+_MAX_UDP_SIZE = 512
+_BIND_ATTEMPTS = 10
+
+_header = struct.Struct('!HHHHHH')
+_families = {TYPE_A: socket.AF_INET, TYPE_AAAA: socket.AF_INET6}
+
+Query = namedtuple('Query', 'id flags name type klass question')
+Response = namedtuple('Response', 'id flags rcode answers')
+Record = namedtuple('Record', 'name type ttl data')
+
+
+def _read_name(data, offset):
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            # Compressed, the rest of the name is somewhere before.
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 127:
+                raise ValueError('Compression loop in DNS name')
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(bytes(data[offset:offset + length]).decode('ascii'))
+        offset += length
+    return '.'.join(labels), offset if end is None else end
+
+
+def _encode_name(name):
+    labels = [label.encode('ascii') for label in name.rstrip('.').split('.') if label]
+    return b''.join(struct.pack('!B', len(label)) + label for label in labels) + b'\0'
+
+
+def build_query(name, type=TYPE_A, id=0, klass=CLASS_IN):
+    return _header.pack(id, 0x0100, 1, 0, 0, 0) + _encode_name(name) + struct.pack('!HH', type, klass)
+
+
+def parse_query(data):
+    data = bytearray(data)
+    id, flags, questions = _header.unpack_from(data)[:3]
+    if flags & _FLAG_RESPONSE or questions != 1:
+        raise ValueError('Not a DNS query with a single question')
+    name, offset = _read_name(data, _header.size)
+    type, klass = struct.unpack_from('!HH', data, offset)
+    return Query(id, flags, name, type, klass, bytes(data[_header.size:offset + 4]))
+
+
+def parse_response(data):
+    data = bytearray(data)
+    id, flags, questions, count = _header.unpack_from(data)[:4]
+    offset = _header.size
+    for _ in range(questions):
+        offset = _read_name(data, offset)[1] + 4
+    answers = []
+    for _ in range(count):
+        name, offset = _read_name(data, offset)
+        type, klass, ttl, length = struct.unpack_from('!HHIH', data, offset)
+        offset += 10
+        rdata = bytes(data[offset:offset + length])
+        offset += length
+        if type in _families and klass == CLASS_IN:
+            rdata = socket.inet_ntop(_families[type], rdata)
+        answers.append(Record(name, type, ttl, rdata))
+    return Response(id, flags, flags & 0xF, answers)
+
+
+def _build_response(query, rcode, addresses=(), ttl=0, authoritative=False, limit=None):
+    flags = _FLAG_RESPONSE | _FLAG_RECURSION_AVAILABLE | (query.flags & _FLAGS_ECHOED) | rcode
+    if authoritative:
+        flags |= _FLAG_AUTHORITATIVE
+    records = []
+    size = _header.size + len(query.question)
+    for address in addresses:
+        # Zone indexes only make sense on the host, they are not part of the record.
+        rdata = socket.inet_pton(_families[query.type], address.partition('%')[0])
+        # The question name is always right after the header.
+        record = struct.pack('!HHHIH', 0xC000 | _header.size, query.type, CLASS_IN, ttl, len(rdata)) + rdata
+        if limit is not None and size + len(record) > limit:
+            flags |= _FLAG_TRUNCATED
+            break
+        size += len(record)
+        records.append(record)
+    return _header.pack(query.id, flags, 1, len(records), 0, 0) + query.question + b''.join(records)
+
+
+def _error(data, rcode):
+    # Answer queries that could not be parsed with a bare header.
+    id, flags = struct.unpack_from('!HH', bytearray(data))
+    return _header.pack(id, _FLAG_RESPONSE | (flags & _FLAGS_ECHOED) | rcode, 0, 0, 0, 0)
+
+
+def nameservers(path=RESOLV_CONF):
+    """Return the (address, port) of the name servers of the system."""
+    servers = []
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    servers.append((fields[1], 53))
+    except (IOError, OSError):
+        pass
+    return servers
+
+
+def _family(host):
+    return socket.AF_INET6 if ':' in host else socket.AF_INET
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise socket.error('Connection closed by the name server')
+        data += chunk
+    return data
+
+
+def _exchange_udp(data, upstream, timeout):
+    sock = socket.socket(_family(upstream[0]), socket.SOCK_DGRAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(upstream)
+        sock.send(data)
+        while True:
+            response = sock.recv(65535)
+            # Stray datagrams with another id are ignored.
+            if response[:2] == data[:2]:
+                return response
+    finally:
+        sock.close()
+
+
+def _exchange_tcp(data, upstream, timeout):
+    sock = socket.create_connection(upstream, timeout)
+    try:
+        sock.sendall(struct.pack('!H', len(data)) + data)
+        length, = struct.unpack('!H', _recv_exactly(sock, 2))
+        return _recv_exactly(sock, length)
+    finally:
+        sock.close()
+
+
+class DNSServer(object):
+    """A DNS server answering A and AAAA queries from the host cache.
+
+    Overridden names and names the process already resolved are answered
+    locally, every other query is forwarded to the ``upstream`` name servers,
+    the system ones by default.  Forwarded responses are cached for their TTL,
+    at most ``max_ttl`` seconds, ``negative_ttl`` seconds when they have no
+    answer.  The server listens on UDP and TCP on the same port.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, upstream=None, timeout=DEFAULT_TIMEOUT,
+                 answer_ttl=DEFAULT_ANSWER_TTL, max_ttl=cache.DEFAULT_TTL,
+                 negative_ttl=cache.DEFAULT_NEGATIVE_TTL, max_size=cache.DEFAULT_MAX_SIZE):
+        self.requested_address = address
+        self.upstream = list(upstream) if upstream is not None else nameservers()
+        self.timeout = timeout
+        self.answer_ttl = answer_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.responses = cache.ExpiringLRUCache(max_size, ttl=max_ttl)
+        self._forwards = cache.SingleFlight()
+        self._servers = []
+
+    @property
+    def address(self):
+        return self._servers[0].server_address[:2] if self._servers else None
+
+    def start(self):
+        # The port picked for UDP is used for TCP as well, another one is
+        # picked when it is taken for TCP.
+        attempts = _BIND_ATTEMPTS if self.requested_address[1] == 0 else 1
+        for attempt in range(attempts):
+            udp = _UDPServer(self.requested_address, _UDPHandler, self)
+            try:
+                tcp = _TCPServer(udp.server_address[:2], _TCPHandler, self)
+                break
+            except socket.error:
+                udp.server_close()
+                if attempt == attempts - 1:
+                    raise
+        self._servers = [udp, tcp]
+        for server in self._servers:
+            thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.1},
+                                      name='hostsresolver-dns-{}'.format(server.transport))
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self):
+        servers, self._servers = self._servers, []
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+    def resolve_locally(self, name, type):
+        """Return the addresses of ``name`` known without asking upstream.
+
+        Returns None when they are not known.
+        """
+        family = _families[type]
+        for candidate in (name, name.lower()):
+            address = cache.lookup_override(candidate, blocking=False)
+            if address is not None:
+                # The name is overridden, it has no address of the other family.
+                return [address] if _family(address) == family else []
+        try:
+            infos = cache.cached_getaddrinfo(name, None, family, socket.SOCK_STREAM)
+        except socket.gaierror:
+            return None
+        if infos is None:
+            return None
+        addresses = []
+        for info in infos:
+            if info[4][0] not in addresses:
+                addresses.append(info[4][0])
+        return addresses
+
+    def handle(self, data, transport):
+        """Return the response to the ``data`` query received over ``transport``."""
+        try:
+            query = parse_query(data)
+        except (ValueError, IndexError, struct.error):
+            return _error(data, RCODE_FORMERR) if len(data) >= 4 else None
+
+        if query.klass == CLASS_IN and query.type in _families:
+            addresses = self.resolve_locally(query.name, query.type)
+            if addresses is not None:
+                limit = _MAX_UDP_SIZE if transport == 'udp' else None
+                try:
+                    return _build_response(query, RCODE_NOERROR, addresses, self.answer_ttl,
+                                           authoritative=True, limit=limit)
+                except (socket.error, ValueError) as e:
+                    logger.warning('Cannot answer %s with %s: %s', query.name, addresses, e)
+                    return _build_response(query, RCODE_SERVFAIL)
+        return self.forward(query, data, transport)
+
+    def forward(self, query, data, transport):
+        key = (query.name.lower(), query.type, query.klass, transport)
+        try:
+            response = self.responses.get(key)
+        except KeyError:
+            try:
+                response = self._forwards.do(key, self._ask_upstream, key, data, transport)
+            except (socket.error, ValueError, IndexError, struct.error) as e:
+                logger.warning('Could not forward the query for %s: %s', query.name, e)
+                return _build_response(query, RCODE_SERVFAIL)
+        return struct.pack('!H', query.id) + response[2:]
+
+    def _ask_upstream(self, key, data, transport):
+        exchange = _exchange_tcp if transport == 'tcp' else _exchange_udp
+        error = socket.error('No upstream name server')
+        for upstream in self.upstream:
+            try:
+                response = exchange(data, upstream, self.timeout)
+                break
+            except socket.error as e:
+                error = e
+        else:
+            raise error
+
+        ttl = self._response_ttl(parse_response(response))
+        if ttl > 0:
+            self.responses.set(key, response, ttl=ttl)
+        return response
+
+    def _response_ttl(self, response):
+        if response.flags & _FLAG_TRUNCATED or response.rcode not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+            return 0
+        if not response.answers:
+            return self.negative_ttl
+        return min([self.max_ttl] + [answer.ttl for answer in response.answers])
+
+
+def start(address=DEFAULT_ADDRESS, upstream=None, **kwargs):
+    """Start a DNSServer in background threads and return it."""
+    return DNSServer(address, upstream, **kwargs).start()
+
+
+class _ServerMixIn(socketserver.ThreadingMixIn):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        logger.exception('Error while answering %s', client_address)
+
+
+class _UDPServer(_ServerMixIn, socketserver.UDPServer):
+    transport = 'udp'
+
+    def __init__(self, address, handler, resolver):
+        self.address_family = _family(address[0])
+        self.resolver = resolver
+        socketserver.UDPServer.__init__(self, address, handler)
+
+
+class _TCPServer(_ServerMixIn, socketserver.TCPServer):
+    transport = 'tcp'
+    allow_reuse_address = True
+
+    def __init__(self, address, handler, resolver):
+        self.address_family = _family(address[0])
+        self.resolver = resolver
+        socketserver.TCPServer.__init__(self, address, handler)
+
+
+class _UDPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+        response = self.server.resolver.handle(data, 'udp')
+        if response is not None:
+            sock.sendto(response, self.client_address)
+
+
+class _TCPHandler(socketserver.StreamRequestHandler):
+    timeout = DEFAULT_IDLE_TIMEOUT
+
+    def handle(self):
+        # Clients may send several queries on the same connection.
+        try:
+            while True:
+                prefix = self.rfile.read(2)
+                if len(prefix) < 2:
+                    return
+                length, = struct.unpack('!H', prefix)
+                data = self.rfile.read(length)
+                if len(data) < length:
+                    return
+                response = self.server.resolver.handle(data, 'tcp')
+                if response is None:
+                    return
+                self.wfile.write(struct.pack('!H', len(response)) + response)
+                self.wfile.flush()
+        except socket.error:
+            return
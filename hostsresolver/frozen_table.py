@@ -0,0 +1,248 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compact read-only host tables for very large static host maps.
+
+Each distinct address is stored once, IPv4 ones as 4 byte integers and IPv6
+ones as 16 bytes, and names point to them by index.  Names are kept sorted
+in a single buffer and found through an open addressing hash index using a
+stable hash, so that a table saved to disk is memory mapped and used as is.
+"""
+
+import array
+import mmap
+import socket
+import struct
+import sys
+import zlib
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from hostsresolver import cache
+from hostsresolver import snapshot as _snapshot
+
+FORMAT_VERSION = 1
+
+_MAGIC = b'HRFT'
+# Magic, version, byte order of the arrays, then the number of names, IPv4
+# addresses, IPv6 addresses and hash slots.
+_header = struct.Struct('<4sHBxIIII')
+_LITTLE_ENDIAN = 1
+_BIG_ENDIAN = 2
+_byte_order = _LITTLE_ENDIAN if sys.byteorder == 'little' else _BIG_ENDIAN
+_EMPTY = -1
+
+
+# Stable across processes, unlike hash().  Masking its result gives the same
+# slot whether it is signed, as on Python 2, or not.
+_crc32 = zlib.crc32
+
+
+def _slot_count(names):
+    # At most half full, probes stay short.
+    count = 8
+    while count < names * 2:
+        count *= 2
+    return count
+
+
+def _to_bytes(values):
+    return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+
+def _from_bytes(typecode, data):
+    values = array.array(typecode)
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    return values
+
+
+class FrozenTable(Mapping):
+    """Read-only mapping of names to addresses, see build() and load()."""
+
+    def __init__(self, names, offsets, addresses, ipv4, ipv6, slots, names_start=0, mapped=None):
+        self._names = names
+        self._names_start = names_start
+        self._offsets = offsets
+        self._addresses = addresses
+        self._ipv4 = ipv4
+        self._ipv6 = ipv6
+        self._slots = slots
+        self._mask = len(slots) - 1
+        self._mapped = mapped
+        # Addresses are only turned into strings when first looked up.
+        self._decoded = {}
+
+    def _name(self, index):
+        start = self._names_start
+        return self._names[start + self._offsets[index]:start + self._offsets[index + 1]]
+
+    def _address(self, index):
+        address = self._decoded.get(index)
+        if address is None:
+            if index < len(self._ipv4):
+                address = socket.inet_ntoa(struct.pack('=I', self._ipv4[index]))
+            else:
+                start = (index - len(self._ipv4)) * 16
+                address = socket.inet_ntop(socket.AF_INET6, bytes(self._ipv6[start:start + 16]))
+            self._decoded[index] = address
+        return address
+
+    def get(self, name, default=None):
+        try:
+            key = name.encode('utf-8')
+        except (AttributeError, UnicodeError):
+            return default
+        names, start, offsets, slots, mask = self._names, self._names_start, self._offsets, self._slots, self._mask
+        slot = _crc32(key) & mask
+        while True:
+            index = slots[slot]
+            if index == _EMPTY:
+                return default
+            if names[start + offsets[index]:start + offsets[index + 1]] == key:
+                return self._address(self._addresses[index])
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, name):
+        address = self.get(name)
+        if address is None:
+            raise KeyError(name)
+        return address
+
+    def __iter__(self):
+        for index in range(len(self._addresses)):
+            yield self._name(index).decode('utf-8')
+
+    def __len__(self):
+        return len(self._addresses)
+
+    def save(self, path):
+        """Write the table to ``path``, replacing it atomically."""
+        ipv6 = bytes(self._ipv6)
+        content = [
+            _header.pack(_MAGIC, FORMAT_VERSION, _byte_order, len(self), len(self._ipv4), len(ipv6) // 16,
+                         len(self._slots)),
+            _to_bytes(array.array('I', self._offsets)),
+            _to_bytes(array.array('I', self._addresses)),
+            _to_bytes(array.array('i', self._slots)),
+            _to_bytes(array.array('I', self._ipv4)),
+            ipv6,
+            bytes(self._names[self._names_start:self._names_start + self._offsets[len(self)]]),
+        ]
+        _snapshot.write_atomically(path, content)
+
+    def close(self):
+        if self._mapped is not None:
+            for view in (self._offsets, self._addresses, self._slots, self._ipv4, self._ipv6):
+                if isinstance(view, memoryview):
+                    view.release()
+            self._mapped.close()
+            self._mapped = None
+
+
+def build(hosts):
+    """Build a table from a mapping or from ``(name, address)`` pairs.
+
+    Names given more than once keep their first address.  Addresses that
+    cannot be packed, IPv6 ones with a zone index such as ``fe80::1%eth0``,
+    are left out with a warning.
+    """
+    pairs = hosts.items() if isinstance(hosts, Mapping) else hosts
+    address_indexes = {}
+    ipv4 = array.array('I')
+    ipv6 = bytearray()
+    ipv6_addresses = []
+    entries = {}
+    for name, address in pairs:
+        key = name.encode('utf-8')
+        if key in entries:
+            continue
+        if address not in address_indexes:
+            packed = _snapshot.pack_address(name, address)
+            if packed is None:
+                continue
+            family, packed = packed
+            if family == socket.AF_INET6:
+                ipv6.extend(packed)
+                address_indexes[address] = None
+                ipv6_addresses.append(address)
+            else:
+                ipv4.extend(struct.unpack('=I', packed))
+                address_indexes[address] = len(ipv4) - 1
+        entries[key] = address
+    # IPv6 addresses come after the IPv4 ones.
+    for index, address in enumerate(ipv6_addresses):
+        address_indexes[address] = len(ipv4) + index
+
+    keys = sorted(entries)
+    offsets = array.array('I', [0])
+    addresses = array.array('I')
+    for key in keys:
+        offsets.append(offsets[-1] + len(key))
+        addresses.append(address_indexes[entries.pop(key)])
+    slots = array.array('i', [_EMPTY]) * _slot_count(len(keys))
+    mask = len(slots) - 1
+    for index, key in enumerate(keys):
+        slot = _crc32(key) & mask
+        while slots[slot] != _EMPTY:
+            slot = (slot + 1) & mask
+        slots[slot] = index
+    return FrozenTable(b''.join(keys), offsets, addresses, ipv4, bytes(ipv6), slots)
+
+
+def load(path):
+    """Map the table saved at ``path``, nothing is copied when possible."""
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, byte_order, names, ipv4_count, ipv6_count, slot_count = _header.unpack_from(mapped)
+    if magic != _MAGIC or version != FORMAT_VERSION:
+        mapped.close()
+        raise ValueError('{} is not a host table'.format(path))
+
+    sections = [('I', names + 1), ('I', names), ('i', slot_count), ('I', ipv4_count), (None, ipv6_count * 16)]
+    # Views on the mapped file need memoryview.cast() and the byte order the
+    # table was built with, the arrays are copied otherwise.
+    copy = not hasattr(memoryview, 'cast') or byte_order != _byte_order
+    offset = _header.size
+    views = []
+    for typecode, count in sections:
+        size = count if typecode is None else count * 4
+        data = mapped[offset:offset + size] if copy else memoryview(mapped)[offset:offset + size]
+        if typecode is not None:
+            if copy:
+                data = _from_bytes(typecode, data)
+                if byte_order != _byte_order:
+                    data.byteswap()
+            else:
+                data = data.cast(typecode)
+        views.append(data)
+        offset += size
+
+    offsets, addresses, slots, ipv4, ipv6 = views
+    return FrozenTable(mapped, offsets, addresses, ipv4, ipv6, slots, names_start=offset, mapped=mapped)
+
+
+def install(path):
+    """Look names up in the table saved at ``path`` and patch the socket module.
+
+    Names of the table come after the layers of the host cache.
+    """
+    table = load(path)
+    cache.attach(table)
+    cache.install()
+    return table
@@ -0,0 +1,222 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Counters and hooks telling how lookups through the host cache went.
+
+Instrumentation is off by default.  enable() swaps the cache's internal
+functions for counting ones and disable() puts the originals back, so a
+disabled instrumentation costs nothing on the lookup paths.
+"""
+
+import bisect
+import logging
+import threading
+
+from hostsresolver import cache
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the upstream latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, float('inf'))
+
+# The learned caches, named as in the stats.
+_caches = (('resolved', '_resolved_cache'), ('addrinfo', '_addrinfo_cache'), ('negative', '_failed_cache'))
+_upstreams = (('gethostbyname', '_gethostbyname'), ('getaddrinfo', '_getaddrinfo'))
+
+_totals = {'hit': 'hits', 'miss': 'misses'}
+
+_lock = threading.Lock()
+_hooks = []
+_originals = {}
+_counters = {}
+
+
+def _empty_counters():
+    return {
+        'hits': dict.fromkeys(['override', 'resolved', 'addrinfo', 'negative'], 0),
+        'misses': dict.fromkeys(['override', 'resolved', 'addrinfo', 'negative'], 0),
+        'overrides': {},
+        'bypassed': 0,
+        'upstream': dict((name, {'calls': 0, 'errors': 0, 'latency': [0] * len(LATENCY_BUCKETS)})
+                         for name, _ in _upstreams),
+    }
+
+
+def _emit(event, source, key, duration=None):
+    with _lock:
+        if event in _totals:
+            _counters[_totals[event]][source] += 1
+        elif event == 'bypass':
+            _counters['bypassed'] += 1
+        hooks = list(_hooks)
+    for hook in hooks:
+        try:
+            hook(event, source, key, duration)
+        except Exception:
+            logger.exception('Instrumentation hook %r failed', hook)
+
+
+def _count_get(source, get):
+    def counting_get(key):
+        try:
+            value = get(key)
+        except KeyError:
+            _emit('miss', source, key)
+            raise
+        _emit('hit', source, key)
+        return value
+    return counting_get
+
+
+def _override_source(host):
+    # Only looked for on hits, the lookup paths do not keep track of it.
+    layers = cache.layers()
+    for layer in layers:
+        if host in layer.hosts:
+            return layer.name
+    for table in list(cache._shared_tables):
+        if getattr(table, 'peek', table.get)(host) is not None:
+            return 'table:{}'.format(getattr(table, 'path', type(table).__name__))
+    labels = host.lower().rstrip('.').split('.')
+    # The deepest rule wins, as in the cache.
+    for index in range(1, len(labels)):
+        suffix = '.'.join(labels[index:])
+        for layer in layers:
+            if '*.' + suffix in layer.hosts or '.' + suffix in layer.hosts:
+                return layer.name
+    return None
+
+
+def _count_override(override):
+    def counting_override(host, blocking=True):
+        address = override(host, blocking)
+        if address is None:
+            _emit('miss', 'override', host)
+            return address
+        source = _override_source(host)
+        with _lock:
+            _counters['overrides'][source] = _counters['overrides'].get(source, 0) + 1
+        _emit('hit', 'override', host)
+        return address
+    return counting_override
+
+
+def _time_upstream(source, function):
+    def timed(host, *args):
+        start = cache._clock()
+        failed = False
+        try:
+            return function(host, *args)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            duration = cache._clock() - start
+            with _lock:
+                counters = _counters['upstream'][source]
+                counters['calls'] += 1
+                counters['errors'] += failed
+                counters['latency'][bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+            _emit('error' if failed else 'upstream', source, host, duration)
+    return timed
+
+
+def _count_bypass(use_host_cache):
+    def counting_use_host_cache(self, address):
+        result = use_host_cache(self, address)
+        if result is address:
+            # Unix sockets, IPv6 and unknown names go to connect() untouched.
+            _emit('bypass', 'socket', address)
+        return result
+    return counting_use_host_cache
+
+
+def enabled():
+    return bool(_originals)
+
+
+def enable():
+    """Start counting, until disable() is called."""
+    with _lock:
+        if _originals:
+            return
+        _counters.update(_empty_counters())
+        for source, name in _caches:
+            lru = getattr(cache, name)
+            # Shadows the method on this instance only.
+            lru.get = _count_get(source, lru.get)
+        for source, name in _upstreams:
+            _originals[name] = getattr(cache, name)
+            setattr(cache, name, _time_upstream(source, _originals[name]))
+        _originals['_override'] = cache._override
+        cache._override = _count_override(cache._override)
+        _originals['_use_host_cache'] = cache.SocketType.__dict__['_use_host_cache']
+        cache.SocketType._use_host_cache = _count_bypass(_originals['_use_host_cache'])
+
+
+def disable():
+    with _lock:
+        if not _originals:
+            return
+        for _, name in _caches:
+            del getattr(cache, name).get
+        for _, name in _upstreams:
+            setattr(cache, name, _originals.pop(name))
+        cache._override = _originals.pop('_override')
+        cache.SocketType._use_host_cache = _originals.pop('_use_host_cache')
+
+
+def reset():
+    with _lock:
+        if _counters:
+            _counters.update(_empty_counters())
+
+
+def add_hook(hook):
+    """Call ``hook(event, source, key, duration)`` for every counted event.
+
+    Events are 'hit' and 'miss' with the cache as source, 'upstream' and
+    'error' for real resolver calls with their duration, and 'bypass' for
+    addresses connected to without the cache.  Hooks run in the looking up
+    thread, they should be quick.
+    """
+    with _lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook):
+    with _lock:
+        _hooks.remove(hook)
+
+
+def stats():
+    """Return the counters, evictions are counted even when disabled.
+
+    ``overrides`` counts the override hits by the layer, or attached table,
+    that answered them.
+    """
+    with _lock:
+        result = {
+            'enabled': bool(_originals),
+            'evictions': dict((source, getattr(cache, name).evictions) for source, name in _caches),
+        }
+        counters = _counters or _empty_counters()
+        result['hits'] = dict(counters['hits'])
+        result['misses'] = dict(counters['misses'])
+        result['overrides'] = dict(counters['overrides'])
+        result['bypassed'] = counters['bypassed']
+        result['upstream'] = dict(
+            (source, {'calls': upstream['calls'], 'errors': upstream['errors'],
+                      'latency': list(zip(LATENCY_BUCKETS, upstream['latency']))})
+            for source, upstream in counters['upstream'].items())
+        return result
@@ -0,0 +1,211 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Host tables shared between processes through memory mapped files.
+
+One process publishes a table, the others map it read-only and look names up
+without copying it.  A table lives in ``<path>.<generation>`` files, each
+publication writing a new one, and ``path`` holds the current generation,
+which readers check on every lookup and follow when it changes.  A single
+process is expected to publish to a given path.
+"""
+
+import mmap
+import os
+import socket
+import struct
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from hostsresolver import cache
+from hostsresolver import snapshot as _snapshot
+
+FORMAT_VERSION = 1
+
+_CONTROL_MAGIC = b'HRSC'
+_TABLE_MAGIC = b'HRST'
+_control = struct.Struct('!4sHxxQ')
+_header = struct.Struct('!4sHxxI')
+# Name offset in the name pool, name length, address family and the packed
+# address, padded to the size of an IPv6 one.
+_record = struct.Struct('!IHBx16s')
+_families = {4: socket.AF_INET, 16: socket.AF_INET6}
+# Readers may race with a publisher removing the table they are opening.
+_OPEN_ATTEMPTS = 5
+
+
+def _table_path(path, generation):
+    return '{}.{}'.format(path, generation)
+
+
+def _map(path):
+    with open(path, 'rb') as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _pack(hosts):
+    names = []
+    for name, address in hosts.items():
+        packed = _snapshot.pack_address(name, address)
+        if packed is not None:
+            names.append((name.encode('utf-8'),) + packed)
+    names.sort()
+
+    records = []
+    pool = []
+    offset = 0
+    for name, family, packed in names:
+        records.append(_record.pack(offset, len(name), len(packed), packed))
+        pool.append(name)
+        offset += len(name)
+    return _header.pack(_TABLE_MAGIC, FORMAT_VERSION, len(names)) + b''.join(records) + b''.join(pool)
+
+
+def read_generation(path):
+    """Return the generation published at ``path``, 0 if there is none."""
+    try:
+        with open(path, 'rb') as file:
+            magic, version, generation = _control.unpack(file.read(_control.size))
+    except (IOError, OSError, struct.error):
+        return 0
+    return generation if magic == _CONTROL_MAGIC and version == FORMAT_VERSION else 0
+
+
+def publish(path, hosts=None):
+    """Publish ``hosts`` at ``path`` and return the new generation.
+
+    ``hosts`` defaults to the names overridden exactly in the host cache,
+    names are sorted so that readers find them with a binary search.
+    """
+    if hosts is None:
+        hosts = cache.overrides()
+    generation = read_generation(path) + 1
+    _snapshot.write_atomically(_table_path(path, generation), [_pack(hosts)])
+
+    control = _control.pack(_CONTROL_MAGIC, FORMAT_VERSION, generation)
+    if generation == 1:
+        _snapshot.write_atomically(path, [control])
+    else:
+        # Updated in place so that readers mapping it see the change.
+        with open(path, 'r+b') as file:
+            mapped = mmap.mmap(file.fileno(), _control.size)
+            try:
+                mapped[:_control.size] = control
+                mapped.flush()
+            finally:
+                mapped.close()
+
+    # The previous table is kept for the readers about to open it.
+    try:
+        os.unlink(_table_path(path, generation - 2))
+    except OSError:
+        pass
+    return generation
+
+
+class SharedTable(Mapping):
+    """Read-only view on the table published at ``path``.
+
+    The table is mapped, not copied.  ``on_change`` is called when a lookup
+    finds that a new generation was published.
+    """
+
+    def __init__(self, path, on_change=None):
+        self.path = path
+        self.on_change = None
+        self._control = _map(path)
+        self._generation = None
+        self._table = None
+        self.refresh()
+        self.on_change = on_change
+
+    @property
+    def generation(self):
+        return _control.unpack_from(self._control)[2]
+
+    def refresh(self):
+        """Follow the current generation, return whether it changed."""
+        generation = self.generation
+        if generation == self._generation:
+            return False
+        for _ in range(_OPEN_ATTEMPTS):
+            try:
+                mapped = _map(_table_path(self.path, generation))
+                break
+            except (IOError, OSError):
+                generation = self.generation
+        else:
+            return False
+
+        magic, version, count = _header.unpack_from(mapped)
+        if magic != _TABLE_MAGIC or version != FORMAT_VERSION:
+            raise ValueError('{} is not a host table'.format(self.path))
+        # Replaced in one step, lookups in other threads see either table.
+        self._table = (mapped, count, _header.size + count * _record.size)
+        self._generation = generation
+        if self.on_change is not None:
+            self.on_change()
+        return True
+
+    def _name(self, table, index):
+        mapped, count, pool = table
+        offset, length = _record.unpack_from(mapped, _header.size + index * _record.size)[:2]
+        return mapped[pool + offset:pool + offset + length]
+
+    def __getitem__(self, name):
+        try:
+            key = name.encode('utf-8')
+        except (AttributeError, UnicodeError):
+            raise KeyError(name)
+        if self.generation != self._generation:
+            self.refresh()
+        table = self._table
+        mapped, count, pool = table
+
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(table, middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == count or self._name(table, low) != key:
+            raise KeyError(name)
+        size, packed = _record.unpack_from(mapped, _header.size + low * _record.size)[2:]
+        return socket.inet_ntop(_families[size], packed[:size])
+
+    def __iter__(self):
+        table = self._table
+        for index in range(table[1]):
+            yield self._name(table, index).decode('utf-8')
+
+    def __len__(self):
+        return self._table[1]
+
+    def close(self):
+        self._control.close()
+        self._table[0].close()
+
+
+def install(path):
+    """Look names up in the table published at ``path`` and patch the socket module.
+
+    Names of the table come after the layers of the host cache.
+    """
+    table = SharedTable(path)
+    cache.attach(table)
+    cache.install()
+    return table
@@ -0,0 +1,94 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Host maps saved to disk along with a fingerprint of what produced them.
+
+Snapshots are replaced atomically, so any number of processes may load and
+save the same snapshot concurrently.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import tempfile
+
+FORMAT_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(paths, *extra):
+    """Digest of the given files' paths, modification times and contents."""
+    digest = hashlib.sha1()
+    for value in extra:
+        digest.update(repr(value).encode('utf-8'))
+    for path in sorted(paths):
+        digest.update(path.encode('utf-8'))
+        try:
+            digest.update(repr(os.stat(path).st_mtime).encode('utf-8'))
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+        except (IOError, OSError):
+            digest.update(b'missing')
+    return digest.hexdigest()
+
+
+def load(path, fingerprint):
+    """Return the hosts saved in ``path`` or None if missing or stale."""
+    try:
+        with open(path) as file:
+            content = json.load(file)
+    except (IOError, OSError, ValueError):
+        return None
+    if content.get('version') != FORMAT_VERSION or content.get('fingerprint') != fingerprint:
+        return None
+    return content['hosts']
+
+
+def save(path, fingerprint, hosts):
+    content = json.dumps({'version': FORMAT_VERSION, 'fingerprint': fingerprint, 'hosts': hosts})
+    write_atomically(path, [content.encode('utf-8')])
+
+
+def write_atomically(path, parts):
+    """Write the ``parts`` bytes to ``path``, replacing it in a single step.
+
+    Readers see either the previous file or the complete new one.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix='.hostsresolver-')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            for part in parts:
+                file.write(part)
+        getattr(os, 'replace', os.rename)(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def pack_address(name, address):
+    """Return the family and packed form of the address of ``name``.
+
+    Returns None, with a warning, for addresses that cannot be packed such as
+    IPv6 ones with a zone index like ``fe80::1%eth0``.
+    """
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    try:
+        return family, socket.inet_pton(family, address)
+    except (socket.error, ValueError):
+        logger.warning('Leaving %s out of the table, its address %s cannot be packed', name, address)
+        return None
@@ -10,24 +10,94 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import logging
+
 from vagrant import Vagrant
 
+from hostsresolver import snapshot as _snapshot
 from hostsresolver.hostsfile_source import parse_content
-from hostsresolver.vagrant_source import list_machines, lookup_vagrant_root
-from hostsresolver.cache import update
+from hostsresolver.vagrant_source import DEFAULT_WORKERS, _map_machines, list_machines, lookup_vagrant_root
+from hostsresolver.vagrant_source import layer_name, snapshot_fingerprint, snapshot_path
+from hostsresolver.cache import DEFAULT_PRIORITY, register
 from hostsresolver.cache import install as _install_cache
 
+# Given as ``names``, asks every machine of the project.
+ALL_MACHINES = '*'
+
+logger = logging.getLogger(__name__)
+
+
+def _fetch(vagrant, machine):
+    return parse_content(vagrant._run_vagrant_command(('ssh', machine, '-c', 'cat /etc/hosts')))
+
+
+def _merge(responses, machines):
+    # Machines given first win conflicts.
+    hosts = {}
+    sources = {}
+    for machine in machines:
+        for name, address in responses.get(machine, {}).items():
+            if name not in hosts:
+                hosts[name] = address
+                sources[name] = machine
+            elif hosts[name] != address:
+                logger.warning('%s is %s on %s but %s on %s, using %s',
+                               name, hosts[name], sources[name], address, machine, hosts[name])
+    return hosts
 
-def known_hosts(vagrant_root, name=None):
+
+def known_hosts(vagrant_root, name=None, snapshot=None, names=None, merge=False, workers=DEFAULT_WORKERS,
+                timeout=None):
+    """Read the hosts managed by vagrant-hostmanager from a machine.
+
+    By default they are read from the ``name`` machine, or the first one.
+    With ``names``, a list of machines or ALL_MACHINES, they are read from
+    several machines at once, each given ``timeout`` seconds.  The first
+    machine answering is used, or with ``merge`` the answers of all of
+    them, conflicts being logged.
+    """
     vagrant_root = lookup_vagrant_root(vagrant_root)
-    vagrant = Vagrant(vagrant_root)
+    if snapshot:
+        path = snapshot_path(vagrant_root, 'hostmanager') if snapshot is True else snapshot
+        fingerprint = snapshot_fingerprint(vagrant_root, 'hostmanager', name, names, merge)
+        hosts = _snapshot.load(path, fingerprint)
+        if hosts is not None:
+            return hosts
 
+    vagrant = Vagrant(vagrant_root)
     machines = list_machines(vagrant_root)
-    name = name if name in machines else machines[0]
 
-    return parse_content(vagrant._run_vagrant_command(('ssh', name, '-c', 'cat /etc/hosts')))
+    if names is None:
+        if not machines:
+            raise RuntimeError('No Vagrant machine to read the hosts of in {}'.format(vagrant_root))
+        if name not in machines:
+            if name is not None:
+                logger.warning('No machine named %s, reading the hosts of %s', name, machines[0])
+            name = machines[0]
+        hosts = _fetch(vagrant, name)
+        complete = True
+    else:
+        candidates = machines if names == ALL_MACHINES else [machine for machine in names if machine in machines]
+        responses = _map_machines(lambda machine: _fetch(vagrant, machine), candidates, workers, timeout,
+                                  first=not merge)
+        if merge:
+            hosts = _merge(responses, candidates)
+            complete = len(responses) == len(candidates)
+        else:
+            hosts = next((responses[machine] for machine in candidates if machine in responses), {})
+            complete = bool(responses)
+
+    # Hosts missing some machine's answer would be served until the machines
+    # change, don't keep them.
+    if snapshot and complete:
+        _snapshot.save(path, fingerprint, hosts)
+    return hosts
 
 
-def install(vagrant_root=None):
-    update(known_hosts(vagrant_root))
+def install(vagrant_root=None, name=None, snapshot=None, priority=DEFAULT_PRIORITY, refresh_interval=None,
+            names=None, merge=False, workers=DEFAULT_WORKERS, timeout=None):
+    vagrant_root = lookup_vagrant_root(vagrant_root)
+    register(layer_name(vagrant_root, 'hostmanager'), priority=priority, refresh_interval=refresh_interval,
+             loader=lambda: known_hosts(vagrant_root, name=name, snapshot=snapshot, names=names, merge=merge,
+                                        workers=workers, timeout=timeout))
     _install_cache()
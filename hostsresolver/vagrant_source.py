@@ -11,11 +11,27 @@
 # limitations under the License.
 
 import glob
+import logging
 import os
+import subprocess
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 from vagrant import Vagrant
 
-from hostsresolver.cache import update
+from hostsresolver import snapshot as _snapshot
+from hostsresolver.cache import DEFAULT_NEGATIVE_TTL, DEFAULT_PRIORITY, ExpiringLRUCache, SingleFlight
+from hostsresolver.cache import attach, register
 from hostsresolver.cache import install as _install_cache
 
 VAGRANT_DOTFILE_PATH = os.environ.get('VAGRANT_DOTFILE_PATH', '.vagrant')
@@ -24,6 +40,12 @@ VAGRANT_CWD = os.environ.get('VAGRANT_CWD', os.getcwd())
 
 vagrant_machines_path = 'machines/*/*/id'.format(**locals())
 
+DEFAULT_WORKERS = 8
+
+logger = logging.getLogger(__name__)
+
+_clock = getattr(time, 'monotonic', time.time)
+
 
 def lookup_vagrant_root(vagrant_root=None):
     vagrant_root = VAGRANT_CWD if vagrant_root is None else vagrant_root
@@ -36,18 +58,294 @@ def lookup_vagrant_root(vagrant_root=None):
     return vagrant_root
 
 
-def list_machines(vagrant_root=None):
+def list_machine_ids(vagrant_root=None):
     vagrant_root = lookup_vagrant_root(vagrant_root)
     search_path = os.path.join(vagrant_root, VAGRANT_DOTFILE_PATH, vagrant_machines_path)
-    return [path.split(os.path.sep)[-3] for path in glob.glob(search_path)]
+    return glob.glob(search_path)
+
+
+def list_machines(vagrant_root=None):
+    return [path.split(os.path.sep)[-3] for path in list_machine_ids(vagrant_root)]
+
+
+def snapshot_path(vagrant_root, kind):
+    return os.path.join(vagrant_root, VAGRANT_DOTFILE_PATH, 'hostsresolver-{}.json'.format(kind))
+
+
+def snapshot_fingerprint(vagrant_root, *extra):
+    """Fingerprint of the machines state, changes when any machine is created,
+    destroyed or recreated, or when the Vagrantfile changes."""
+    paths = list_machine_ids(vagrant_root) + [os.path.join(vagrant_root, VAGRANT_VAGRANTFILE)]
+    return _snapshot.fingerprint(paths, *extra)
+
+
+def _map_machines(function, machines, workers=DEFAULT_WORKERS, timeout=None, first=False):
+    """Call ``function(machine)`` for every machine using a pool of threads.
+
+    Returns the results of the calls that succeeded within ``timeout``
+    seconds of being started, failures are logged and left out.  With
+    ``first``, returns as soon as a call succeeded, the calls still running
+    are abandoned.
+    """
+    if not machines:
+        return {}
+
+    started = {}
+    queued = queue.Queue()
+    for machine in machines:
+        queued.put(machine)
+    answers = queue.Queue()
+    stopped = threading.Event()
+
+    def work():
+        while not stopped.is_set():
+            try:
+                machine = queued.get_nowait()
+            except queue.Empty:
+                return
+            started[machine] = _clock()
+            try:
+                answers.put((machine, function(machine), None))
+            except Exception as e:
+                answers.put((machine, None, e))
+
+    workers = max(1, min(workers, len(machines)))
+    for _ in range(workers):
+        # Daemon threads, unlike the executor ones, so that an abandoned call
+        # stuck in Vagrant does not hold the process at exit.
+        thread = threading.Thread(target=work, name='hostsresolver-vagrant')
+        thread.daemon = True
+        thread.start()
+    # Machines still queued when every worker is stuck on a timed out call
+    # would never start, give up on them after as many timeouts as it takes
+    # to go through the queue.
+    deadline = None if timeout is None else _clock() + timeout * -(-len(machines) // workers)
+
+    pending = set(machines)
+    results = {}
+    try:
+        while pending:
+            wait_for = None
+            if timeout is not None:
+                now = _clock()
+                ends = [started[machine] + timeout for machine in pending if machine in started]
+                wait_for = max(0, min(ends + [deadline]) - now)
+
+            try:
+                machine, result, error = answers.get(timeout=wait_for)
+            except queue.Empty:
+                pass
+            else:
+                # Answers of abandoned calls may still come in.
+                if machine in pending:
+                    pending.remove(machine)
+                    if error is None:
+                        results[machine] = result
+                    else:
+                        logger.warning('Could not resolve %s: %s', machine, error)
+            if first and results:
+                break
+
+            if timeout is not None:
+                now = _clock()
+                for machine in list(pending):
+                    if now >= deadline or (machine in started and now - started[machine] >= timeout):
+                        logger.warning('Timed out resolving %s after %ss', machine, timeout)
+                        pending.remove(machine)
+    finally:
+        stopped.set()
+    return results
+
+
+def parse_ssh_config(content):
+    """Map every ``Host`` of ``vagrant ssh-config`` output to its ``HostName``."""
+    hosts = {}
+    host = None
+    for line in content.splitlines():
+        key, _, value = line.strip().partition(' ')
+        if key == 'Host':
+            host = value.strip()
+        elif key == 'HostName' and host is not None:
+            hosts[host] = value.strip().strip('"')
+    return hosts
+
+
+def _bulk_hostnames(vagrant, machines):
+    # A single `vagrant ssh-config` describes every running machine, it fails
+    # as a whole as soon as one of them is not reachable.
+    try:
+        hosts = parse_ssh_config(vagrant.ssh_config())
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.debug('Could not get the ssh configuration of all machines at once: %s', e)
+        return {}
+    return {machine: hosts[machine] for machine in machines if machine in hosts}
+
 
+def known_hosts(vagrant_root, workers=DEFAULT_WORKERS, timeout=None, snapshot=None):
+    """Map the name of each Vagrant machine to its address.
 
-def known_hosts(vagrant_root):
+    With ``snapshot`` set to True, or to a file path, the map is saved to
+    disk and reused as long as no machine and the Vagrantfile changed.
+    """
     vagrant_root = lookup_vagrant_root(vagrant_root)
+    if snapshot:
+        path = snapshot_path(vagrant_root, 'vagrant') if snapshot is True else snapshot
+        fingerprint = snapshot_fingerprint(vagrant_root, 'vagrant')
+        hosts = _snapshot.load(path, fingerprint)
+        if hosts is not None:
+            return hosts
+
     vagrant = Vagrant(vagrant_root)
-    return {machine: vagrant.hostname(machine) for machine in list_machines(vagrant_root)}
+    machines = list_machines(vagrant_root)
+    hosts = _bulk_hostnames(vagrant, machines)
+    missing = [machine for machine in machines if machine not in hosts]
+    hosts.update(_map_machines(vagrant.hostname, missing, workers, timeout))
+    hosts = {machine: address for machine, address in hosts.items() if address is not None}
+
+    # A partial map would be served until the machines change, don't keep it.
+    if snapshot and len(hosts) == len(machines):
+        _snapshot.save(path, fingerprint, hosts)
+    return hosts
+
+
+def machine_signatures(vagrant_root):
+    """Map each machine to the state of its id file, which changes when the
+    machine is created again."""
+    signatures = {}
+    for path in list_machine_ids(vagrant_root):
+        try:
+            stat = os.stat(path)
+            with open(path) as file:
+                signatures[path.split(os.path.sep)[-3]] = (file.read(), stat.st_mtime, stat.st_ino)
+        except (IOError, OSError):
+            continue
+    return signatures
+
+
+class RefreshingLoader(object):
+    """Loader resolving every machine at first, then only the machines whose
+    id changed since they were resolved.
+
+    Machines that cannot be resolved keep their last known address and are
+    tried again on the next call.  Returns None when nothing changed.
+    """
+
+    def __init__(self, vagrant_root, workers=DEFAULT_WORKERS, timeout=None, snapshot=None):
+        self.vagrant_root = lookup_vagrant_root(vagrant_root)
+        self.workers = workers
+        self.timeout = timeout
+        self.snapshot = snapshot
+        self.hosts = None
+        self.signatures = {}
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            signatures = machine_signatures(self.vagrant_root)
+            if self.hosts is None:
+                self.hosts = known_hosts(self.vagrant_root, self.workers, self.timeout, self.snapshot)
+                self.signatures = {machine: signature for machine, signature in signatures.items()
+                                   if machine in self.hosts}
+                return self.hosts
+
+            changed = [machine for machine, signature in signatures.items()
+                       if self.signatures.get(machine) != signature]
+            removed = [machine for machine in self.hosts if machine not in signatures]
+            if not changed and not removed:
+                return None
+
+            hosts = {machine: address for machine, address in self.hosts.items() if machine not in removed}
+            for machine in removed:
+                self.signatures.pop(machine, None)
+            resolved = _map_machines(Vagrant(self.vagrant_root).hostname, changed, self.workers, self.timeout)
+            for machine, address in resolved.items():
+                if address is not None:
+                    hosts[machine] = address
+                    self.signatures[machine] = signatures[machine]
+
+            if hosts == self.hosts:
+                return None
+            self.hosts = hosts
+            return hosts
+
 
+class LazyMachines(Mapping):
+    """Addresses of the machines of a project, each one resolved on its
+    first lookup with its own `vagrant ssh-config` and then remembered.
 
-def install(vagrant_root):
-    update(known_hosts(vagrant_root))
+    Only the names of the machines are listed up front, looking up any
+    other name never runs Vagrant.  Failures are remembered for
+    ``negative_ttl`` seconds.
+    """
+
+    def __init__(self, vagrant_root, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.vagrant_root = lookup_vagrant_root(vagrant_root)
+        self.names = frozenset(list_machines(self.vagrant_root))
+        self._addresses = {}
+        self._failures = ExpiringLRUCache(None, ttl=negative_ttl)
+        self._lookups = SingleFlight()
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        try:
+            return self._addresses[name]
+        except KeyError:
+            pass
+        if name in self._failures:
+            raise KeyError(name)
+        address = self._lookups.do(name, self._resolve, name)
+        if address is None:
+            raise KeyError(name)
+        return address
+
+    def peek(self, name):
+        """Return the address of ``name`` if already resolved, without
+        running Vagrant."""
+        return self._addresses.get(name)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _resolve(self, name):
+        # python-vagrant raises RuntimeError when the vagrant executable is missing.
+        try:
+            address = Vagrant(self.vagrant_root).hostname(name)
+        except (subprocess.CalledProcessError, OSError, RuntimeError) as e:
+            logger.warning('Could not resolve %s: %s', name, e)
+            address = None
+        if address is None:
+            self._failures.set(name, True)
+        else:
+            self._addresses[name] = address
+        return address
+
+
+def layer_name(vagrant_root, kind='vagrant'):
+    return '{}:{}'.format(kind, os.path.abspath(lookup_vagrant_root(vagrant_root)))
+
+
+def install(vagrant_root, workers=DEFAULT_WORKERS, timeout=None, snapshot=None, priority=DEFAULT_PRIORITY,
+            refresh_interval=None, jitter=0, lazy=False):
+    """Override the names of the Vagrant machines with their address.
+
+    The names are kept in their own cache layer.  With ``refresh_interval``,
+    a background thread resolves again the machines recreated since, every
+    ``refresh_interval`` seconds give or take ``jitter``, while lookups keep
+    getting the last known addresses.
+
+    With ``lazy``, each machine is resolved on its first lookup instead, see
+    LazyMachines, and the other arguments are ignored.
+    """
+    vagrant_root = lookup_vagrant_root(vagrant_root)
+    if lazy:
+        machines = LazyMachines(vagrant_root)
+        attach(machines)
+        _install_cache()
+        return machines
+    register(layer_name(vagrant_root), priority=priority, refresh_interval=refresh_interval, jitter=jitter,
+             loader=RefreshingLoader(vagrant_root, workers=workers, timeout=timeout, snapshot=snapshot))
     _install_cache()
@@ -0,0 +1,62 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Poller(object):
+    """Call ``check`` every ``interval`` seconds from a daemon thread.
+
+    Each wait is randomly lengthened or shortened by up to ``jitter``
+    seconds, so that processes started together do not poll in lockstep.
+    """
+
+    def __init__(self, check, interval, jitter=0, name=None):
+        self.check = check
+        self.interval = interval
+        self.jitter = jitter
+        self.name = name
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _next_wait(self):
+        return max(0, self.interval + random.uniform(-self.jitter, self.jitter))
+
+    def _run(self):
+        while not self._stopped.wait(self._next_wait()):
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Polling %s failed', self.name or self.check)
@@ -0,0 +1,114 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributedvagrant_instance under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import unittest
+
+import mock
+
+from hostsresolver import cache
+
+try:
+    import asyncio
+    from hostsresolver import aio
+except (ImportError, SyntaxError):
+    aio = None
+
+
+@unittest.skipIf(aio is None, 'asyncio support requires Python 3.5')
+class TestGetAddrInfo(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        aio.install()
+        self.addCleanup(aio.uninstall)
+
+    def test_overrides_are_answered_without_the_executor(self):
+        cache.update({'first.machine.example.org': '1.1.1.1'})
+
+        with mock.patch.object(self.loop, 'run_in_executor') as executor_mock:
+            result = self.loop.run_until_complete(
+                self.loop.getaddrinfo('first.machine.example.org', 80, type=socket.SOCK_STREAM))
+
+        self.assertListEqual(result, [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('1.1.1.1', 80))])
+        self.assertFalse(executor_mock.called)
+
+    @mock.patch("hostsresolver.cache._getaddrinfo")
+    def test_concurrent_misses_share_one_executor_lookup(self, getaddrinfo_mock):
+        results = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('1.1.1.1', 80))]
+        getaddrinfo_mock.return_value = results
+
+        async def resolve_many():
+            return await asyncio.gather(*[self.loop.getaddrinfo('first.machine.example.org', 80)
+                                          for _ in range(10)])
+
+        self.assertListEqual(self.loop.run_until_complete(resolve_many()), [results] * 10)
+        getaddrinfo_mock.assert_called_once_with('first.machine.example.org', 80, 0, 0, 0, 0)
+
+        with mock.patch.object(self.loop, 'run_in_executor') as executor_mock:
+            self.loop.run_until_complete(self.loop.getaddrinfo('first.machine.example.org', 80))
+        self.assertFalse(executor_mock.called)
+
+    @mock.patch("hostsresolver.cache._getaddrinfo")
+    def test_failed_lookups_are_raised(self, getaddrinfo_mock):
+        getaddrinfo_mock.side_effect = socket.gaierror(-2, 'Name or service not known')
+
+        with self.assertRaises(socket.gaierror):
+            self.loop.run_until_complete(self.loop.getaddrinfo('unknown.example.org', 80))
+
+    def test_create_connection_uses_overrides(self):
+        cache.update({'first.machine.example.org': '127.0.0.1'})
+
+        async def connect():
+            server = await asyncio.start_server(lambda reader, writer: writer.close(), '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('first.machine.example.org', port)
+            peer = writer.get_extra_info('peername')
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return peer
+
+        self.assertEqual(self.loop.run_until_complete(connect())[0], '127.0.0.1')
+
+    def test_uninstall_restores_the_loop_resolver(self):
+        aio.uninstall()
+        cache.update({'first.machine.example.org': '1.1.1.1'})
+
+        with self.assertRaises(socket.gaierror):
+            self.loop.run_until_complete(self.loop.getaddrinfo('first.machine.example.org', 80))
+
+
+@unittest.skipIf(aio is None, 'asyncio support requires Python 3.5')
+class TestInstallOnALoop(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.other_loop = asyncio.new_event_loop()
+        self.addCleanup(self.other_loop.close)
+
+    def test_only_the_given_loop_is_patched(self):
+        cache.update({'first.machine.example.org': '1.1.1.1'})
+        aio.install(self.loop)
+        self.addCleanup(aio.uninstall, self.loop)
+
+        self.assertEqual(
+            self.loop.run_until_complete(self.loop.getaddrinfo('first.machine.example.org', 80))[0][4],
+            ('1.1.1.1', 80))
+        with self.assertRaises(socket.gaierror):
+            self.other_loop.run_until_complete(self.other_loop.getaddrinfo('first.machine.example.org', 80))
@@ -12,12 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import socket
+import sys
+import threading
+import time
 import unittest
 
 import mock
 
-from hostsresolver import cache
+from hostsresolver import cache, hostsfile_source
 
 
 class TestGetHostByName(unittest.TestCase):
@@ -47,6 +51,242 @@ class TestGetHostByName(unittest.TestCase):
         self.assertEqual(socket.gethostbyname('google-public-dns-a.google.com'), '8.8.8.8')
 
 
+class TestResolvedCache(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.configure, ttl=cache.DEFAULT_TTL, max_size=cache.DEFAULT_MAX_SIZE)
+        self.addCleanup(cache.clear)
+
+        patcher = mock.patch("hostsresolver.cache._gethostbyname")
+        self.gethost_mock = patcher.start()
+        self.gethost_mock.side_effect = lambda host: '1.1.1.%d' % self.gethost_mock.call_count
+        self.addCleanup(patcher.stop)
+
+        self.now = 1000.0
+        patcher = mock.patch("hostsresolver.cache._clock", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_learned_entries_are_served_until_they_expire(self):
+        cache.configure(ttl=10)
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+        self.now += 9
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+        self.now += 1
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.2')
+        self.assertEqual(self.gethost_mock.call_count, 2)
+
+    def test_learned_entries_never_expire_without_ttl(self):
+        cache.configure(ttl=None)
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+        self.now += 10 ** 9
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache.configure(max_size=2)
+
+        cache.gethostbyname('first.machine.example.org')
+        cache.gethostbyname('second.machine.example.org')
+        cache.gethostbyname('first.machine.example.org')
+        cache.gethostbyname('third.machine.example.org')
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+        self.assertEqual(cache.gethostbyname('second.machine.example.org'), '1.1.1.4')
+
+    def test_pinned_entries_neither_expire_nor_count_against_the_limit(self):
+        cache.configure(ttl=10, max_size=1)
+        cache.update({'first.machine.example.org': '2.2.2.2',
+                      'second.machine.example.org': '3.3.3.3'})
+
+        self.now += 10 ** 9
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '2.2.2.2')
+        self.assertEqual(cache.gethostbyname('second.machine.example.org'), '3.3.3.3')
+        self.assertFalse(self.gethost_mock.called)
+
+    def test_install_configures_the_cache(self):
+        self.addCleanup(cache.uninstall)
+        cache.install(ttl=5, max_size=1)
+
+        socket.gethostbyname('first.machine.example.org')
+        socket.gethostbyname('second.machine.example.org')
+        self.assertEqual(socket.gethostbyname('first.machine.example.org'), '1.1.1.3')
+        self.now += 5
+        self.assertEqual(socket.gethostbyname('first.machine.example.org'), '1.1.1.4')
+
+
+class TestLayers(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_ipv6_overrides_are_only_given_by_getaddrinfo(self):
+        cache.update({'first.machine.example.org': '2001:db8::1'})
+
+        self.assertRaises(socket.gaierror, cache.gethostbyname, 'first.machine.example.org')
+        self.assertEqual(cache.getaddrinfo('first.machine.example.org', 80, socket.AF_INET6)[0][4][0],
+                         '2001:db8::1')
+        with cache.overlay({'second.machine.example.org': '2001:db8::2'}):
+            self.assertRaises(socket.gaierror, cache.gethostbyname, 'second.machine.example.org')
+
+    def test_highest_priority_layer_wins(self):
+        cache.register('high', priority=10)
+        cache.update({'first.machine.example.org': '1.1.1.1'}, layer='high')
+        cache.update({'first.machine.example.org': '2.2.2.2', 'second.machine.example.org': '2.2.2.2'},
+                     layer='low')
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+        self.assertEqual(cache.gethostbyname('second.machine.example.org'), '2.2.2.2')
+
+    def test_last_registered_layer_wins_among_equals(self):
+        cache.update({'first.machine.example.org': '1.1.1.1'}, layer='first')
+        cache.update({'first.machine.example.org': '2.2.2.2'}, layer='second')
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '2.2.2.2')
+
+    def test_changing_the_priority_reorders_the_layers(self):
+        cache.update({'first.machine.example.org': '1.1.1.1'}, layer='first')
+        cache.update({'first.machine.example.org': '2.2.2.2'}, layer='second')
+
+        cache.register('first', priority=1)
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+        self.assertListEqual([layer.name for layer in cache.layers()], ['first', 'second'])
+
+    @mock.patch("hostsresolver.cache._gethostbyname")
+    def test_replacing_a_layer_leaves_the_others_alone(self, gethost_mock):
+        gethost_mock.side_effect = socket.gaierror(-2, 'Name or service not known')
+        cache.update({'first.machine.example.org': '1.1.1.1', 'other.example.org': '3.3.3.3'}, layer='low')
+        cache.register('high', priority=10)
+        cache.update({'first.machine.example.org': '2.2.2.2', 'second.machine.example.org': '2.2.2.2'},
+                     layer='high')
+
+        cache.replace({'third.machine.example.org': '4.4.4.4'}, layer='high')
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+        self.assertEqual(cache.gethostbyname('other.example.org'), '3.3.3.3')
+        self.assertEqual(cache.gethostbyname('third.machine.example.org'), '4.4.4.4')
+        self.assertRaises(socket.gaierror, cache.gethostbyname, 'second.machine.example.org')
+
+    @mock.patch("hostsresolver.cache._gethostbyname")
+    def test_unregistered_layers_are_forgotten(self, gethost_mock):
+        gethost_mock.side_effect = socket.gaierror(-2, 'Name or service not known')
+        cache.update({'first.machine.example.org': '1.1.1.1'}, layer='low')
+        cache.update({'first.machine.example.org': '2.2.2.2', 'second.machine.example.org': '2.2.2.2'},
+                     layer='high')
+
+        cache.unregister('high')
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+        self.assertRaises(socket.gaierror, cache.gethostbyname, 'second.machine.example.org')
+
+    def test_layers_with_a_loader_are_loaded_and_refreshed(self):
+        loader = mock.Mock(return_value={'first.machine.example.org': '1.1.1.1'})
+        cache.register('source', loader=loader)
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+
+        loader.return_value = {'first.machine.example.org': '2.2.2.2'}
+        cache.refresh('source')
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '2.2.2.2')
+        self.assertEqual(loader.call_count, 2)
+
+    def test_layers_are_refreshed_periodically(self):
+        refreshed = threading.Event()
+
+        def loader():
+            if loader.calls:
+                refreshed.set()
+            loader.calls += 1
+            return {'first.machine.example.org': '1.1.1.%d' % loader.calls}
+        loader.calls = 0
+
+        cache.register('source', loader=loader, refresh_interval=0.01)
+
+        self.assertTrue(refreshed.wait(5))
+        self.assertNotEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+
+    def test_changing_the_priority_keeps_the_loader_and_its_refresh(self):
+        loader = mock.Mock(return_value={'first.machine.example.org': '1.1.1.1'})
+        layer = cache.register('source', loader=loader, refresh_interval=60)
+        poller = layer.poller
+
+        cache.register('source', priority=5)
+
+        self.assertEqual(layer.priority, 5)
+        self.assertIs(layer.loader, loader)
+        self.assertIs(layer.poller, poller)
+        self.assertTrue(poller.running)
+        self.assertEqual(loader.call_count, 1)
+
+
+class TestSuffixRules(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_rules_cover_subdomains(self):
+        cache.update({'*.svc.test': '10.0.0.5'})
+
+        self.assertEqual(cache.gethostbyname('keystone.svc.test'), '10.0.0.5')
+        self.assertEqual(cache.gethostbyname('Nova.Region-1.SVC.test.'), '10.0.0.5')
+
+    @mock.patch("hostsresolver.cache._gethostbyname")
+    def test_rules_do_not_cover_the_domain_itself(self, gethost_mock):
+        gethost_mock.return_value = '3.3.3.3'
+        cache.update({'.svc.test': '10.0.0.5'})
+
+        self.assertEqual(cache.gethostbyname('svc.test'), '3.3.3.3')
+        self.assertEqual(cache.gethostbyname('othersvc.test'), '3.3.3.3')
+
+    def test_exact_names_take_precedence(self):
+        cache.update({'*.svc.test': '10.0.0.5'}, layer='rules')
+        cache.update({'keystone.svc.test': '10.0.0.6'}, layer='low')
+        cache.register('low', priority=-1)
+
+        self.assertEqual(cache.gethostbyname('keystone.svc.test'), '10.0.0.6')
+        self.assertEqual(cache.gethostbyname('nova.svc.test'), '10.0.0.5')
+
+    def test_deepest_rule_wins(self):
+        cache.update({'.test': '10.0.0.1', '.svc.test': '10.0.0.5'})
+
+        self.assertEqual(cache.gethostbyname('keystone.svc.test'), '10.0.0.5')
+        self.assertEqual(cache.gethostbyname('keystone.other.test'), '10.0.0.1')
+
+    def test_highest_priority_layer_wins(self):
+        cache.update({'*.svc.test': '10.0.0.5'}, layer='low')
+        cache.register('high', priority=10)
+        cache.update({'.svc.test': '10.0.0.6'}, layer='high')
+
+        self.assertEqual(cache.gethostbyname('keystone.svc.test'), '10.0.0.6')
+
+        cache.unregister('high')
+
+        self.assertEqual(cache.gethostbyname('keystone.svc.test'), '10.0.0.5')
+
+    @mock.patch("hostsresolver.cache._gethostbyname")
+    def test_replaced_rules_are_removed(self, gethost_mock):
+        gethost_mock.return_value = '3.3.3.3'
+        cache.update({'*.svc.test': '10.0.0.5', '*.other.test': '10.0.0.6'}, layer='rules')
+
+        cache.replace({'*.other.test': '10.0.0.6'}, layer='rules')
+
+        self.assertEqual(cache.gethostbyname('keystone.svc.test'), '3.3.3.3')
+        self.assertEqual(cache.gethostbyname('keystone.other.test'), '10.0.0.6')
+        self.assertDictEqual(cache._suffix_index, {'test': {'other': {None: '10.0.0.6'}}})
+
+    @mock.patch("hostsresolver.cache._numeric_getaddrinfo")
+    @mock.patch("hostsresolver.cache._getaddrinfo")
+    def test_rules_are_resolved_numerically(self, getaddrinfo_mock, numeric_mock):
+        cache.update({'*.svc.test': '10.0.0.5'})
+
+        cache.getaddrinfo('keystone.svc.test', 80)
+
+        numeric_mock.assert_called_once_with('10.0.0.5', 80, 0, 0, 0, socket.AI_NUMERICHOST)
+        self.assertFalse(getaddrinfo_mock.called)
+
+
 class TestGetAddrInfo(unittest.TestCase):
     def setUp(self):
         cache.uninstall()
@@ -68,12 +308,15 @@ class TestGetAddrInfo(unittest.TestCase):
         cache.clear()
         cache.install()
         self.assertRaises(socket.gaierror, socket.getaddrinfo, 'first.machine.example.org', 22)
-        # Here we only get IPv4 data as we use our name resolution
+        # Here we get the same IPv4 & IPv6 data as the real resolver
         self.assertListEqual(
             socket.getaddrinfo('google-public-dns-a.google.com', 53),
             [(2, 1, 6, '', ('8.8.8.8', 53)),
              (2, 2, 17, '', ('8.8.8.8', 53)),
-             (2, 3, 0, '', ('8.8.8.8', 53))])
+             (2, 3, 0, '', ('8.8.8.8', 53)),
+             (10, 1, 6, '', ('2001:4860:4860::8888', 53, 0, 0)),
+             (10, 2, 17, '', ('2001:4860:4860::8888', 53, 0, 0)),
+             (10, 3, 0, '', ('2001:4860:4860::8888', 53, 0, 0))])
 
         cache.update({'first.machine.example.org': '1.1.1.1'})
         self.assertListEqual(
@@ -82,13 +325,6 @@ class TestGetAddrInfo(unittest.TestCase):
              (2, 2, 17, '', ('1.1.1.1', 80)),
              (2, 3, 0, '', ('1.1.1.1', 80))])
 
-        # Here we only get IPv4 data as we use our name resolution
-        self.assertListEqual(
-            socket.getaddrinfo('google-public-dns-a.google.com', 53),
-            [(2, 1, 6, '', ('8.8.8.8', 53)),
-             (2, 2, 17, '', ('8.8.8.8', 53)),
-             (2, 3, 0, '', ('8.8.8.8', 53))])
-
     def test_uninstall_returns_original_state(self):
         cache.install()
         cache.update({'first.machine.example.org': '1.1.1.1'})
@@ -107,8 +343,401 @@ class TestGetAddrInfo(unittest.TestCase):
              (10, 3, 0, '', ('2001:4860:4860::8888', 53, 0, 0))])
 
 
+class TestAddrInfoCache(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        patcher = mock.patch("hostsresolver.cache._getaddrinfo")
+        self.getaddrinfo_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("hostsresolver.cache._numeric_getaddrinfo")
+        self.numeric_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_complete_results_are_served_from_the_cache(self):
+        results = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('1.1.1.1', 80)),
+                   (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('1.1.1.2', 80)),
+                   (socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('2001:db8::1', 80, 0, 0))]
+        self.getaddrinfo_mock.return_value = results
+
+        self.assertListEqual(cache.getaddrinfo('first.machine.example.org', 80, 0, socket.SOCK_STREAM), results)
+        self.assertListEqual(cache.getaddrinfo('first.machine.example.org', 80, 0, socket.SOCK_STREAM), results)
+
+        self.getaddrinfo_mock.assert_called_once_with('first.machine.example.org', 80, 0, socket.SOCK_STREAM, 0, 0)
+
+    def test_each_set_of_arguments_is_cached_separately(self):
+        cache.getaddrinfo('first.machine.example.org', 80)
+        cache.getaddrinfo('first.machine.example.org', 443)
+        cache.getaddrinfo('first.machine.example.org', 80, socket.AF_INET6)
+        cache.getaddrinfo('first.machine.example.org', 80, flags=socket.AI_CANONNAME)
+
+        self.assertEqual(self.getaddrinfo_mock.call_count, 4)
+
+    def test_returned_lists_are_copies(self):
+        self.getaddrinfo_mock.return_value = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('1.1.1.1', 80))]
+
+        cache.getaddrinfo('first.machine.example.org', 80).pop()
+
+        self.assertEqual(len(cache.getaddrinfo('first.machine.example.org', 80)), 1)
+
+    def test_overrides_are_resolved_numerically(self):
+        cache.update({'first.machine.example.org': '2001:db8::1'})
+
+        cache.getaddrinfo('first.machine.example.org', 80, socket.AF_INET6)
+
+        self.numeric_mock.assert_called_once_with(
+            '2001:db8::1', 80, socket.AF_INET6, 0, 0, socket.AI_NUMERICHOST)
+        self.assertFalse(self.getaddrinfo_mock.called)
+
+    def test_overrides_replace_previously_cached_results(self):
+        self.getaddrinfo_mock.side_effect = socket.gaierror(-2, 'Name or service not known')
+        self.assertRaises(socket.gaierror, cache.getaddrinfo, 'first.machine.example.org', 80)
+        self.assertRaises(socket.gaierror, cache.getaddrinfo, 'first.machine.example.org', 80)
+        self.assertEqual(self.getaddrinfo_mock.call_count, 1)
+
+        cache.update({'first.machine.example.org': '1.1.1.1'})
+        self.getaddrinfo_mock.side_effect = None
+        cache.getaddrinfo('first.machine.example.org', 80)
+
+        self.numeric_mock.assert_called_once_with('1.1.1.1', 80, 0, 0, 0, socket.AI_NUMERICHOST)
+        self.assertEqual(self.getaddrinfo_mock.call_count, 1)
+
+    def test_literal_addresses_are_not_cached(self):
+        cache.getaddrinfo('1.1.1.1', 80)
+        cache.getaddrinfo('1.1.1.1', 80)
+
+        self.assertEqual(self.getaddrinfo_mock.call_count, 2)
+
+
+class TestConcurrentLookups(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.release = threading.Event()
+        patcher = mock.patch("hostsresolver.cache._gethostbyname")
+        self.gethost_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _blocking_lookup(self, result):
+        def lookup(host):
+            self.release.wait(5)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return lookup
+
+    def _run_threads(self, count, function):
+        results = []
+
+        def run():
+            try:
+                results.append(function())
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_concurrent_misses_share_one_upstream_lookup(self):
+        self.gethost_mock.side_effect = self._blocking_lookup('1.1.1.1')
+
+        results = self._run_threads(20, lambda: cache.gethostbyname('first.machine.example.org'))
+
+        self.assertListEqual(results, ['1.1.1.1'] * 20)
+        self.gethost_mock.assert_called_once_with('first.machine.example.org')
+
+    def test_concurrent_failures_share_one_upstream_lookup(self):
+        self.gethost_mock.side_effect = self._blocking_lookup(socket.gaierror(-2, 'Name or service not known'))
+
+        results = self._run_threads(20, lambda: cache.gethostbyname('unknown.example.org'))
+
+        self.assertEqual(len(results), 20)
+        for result in results:
+            self.assertIsInstance(result, socket.gaierror)
+        self.assertEqual(self.gethost_mock.call_count, 1)
+
+    def test_lookups_finishing_after_an_update_are_not_cached(self):
+        def lookup(host):
+            cache.update({'second.machine.example.org': '2.2.2.2'})
+            return '1.1.1.1'
+        self.gethost_mock.side_effect = lookup
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+        self.gethost_mock.side_effect = None
+        self.gethost_mock.return_value = '3.3.3.3'
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '3.3.3.3')
+
+
+class TestInstall(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(cache.uninstall)
+
+    def assertSocketType(self, socket_type):
+        self.assertIs(socket.SocketType, socket_type)
+        if sys.version_info > (3,):
+            import _socket
+            self.assertIs(_socket.socket, socket_type)
+        else:
+            self.assertIs(socket.socket, socket_type)
+
+    def test_socket_type_is_patched_by_default(self):
+        cache.install()
+
+        self.assertIs(socket.getaddrinfo, cache.getaddrinfo)
+        self.assertSocketType(cache.SocketType)
+
+    def test_resolution_only_leaves_the_socket_type_alone(self):
+        cache.install(socket_type=False)
+
+        self.assertIs(socket.getaddrinfo, cache.getaddrinfo)
+        self.assertIs(socket.gethostbyname, cache.gethostbyname)
+        self.assertIs(socket.create_connection, cache.create_connection)
+        self.assertSocketType(cache._SocketType)
+
+    def test_installing_again_switches_the_strategy(self):
+        cache.install()
+        cache.install(socket_type=False)
+
+        self.assertSocketType(cache._SocketType)
+
+    def test_installing_again_keeps_the_strategy_by_default(self):
+        cache.install(socket_type=False)
+        cache.install(ttl=60)
+
+        self.assertSocketType(cache._SocketType)
+
+    def test_sources_keep_the_resolution_only_strategy(self):
+        hosts_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hosts')
+        self.addCleanup(cache.clear)
+        cache.install(socket_type=False)
+
+        hostsfile_source.install(hosts_file)
+
+        self.assertSocketType(cache._SocketType)
+        self.assertEqual('1.1.1.1', socket.gethostbyname('first.machine.example.org'))
+
+    def test_uninstall_restores_everything(self):
+        cache.install()
+        cache.uninstall()
+
+        self.assertIs(socket.getaddrinfo, cache._stock_getaddrinfo)
+        self.assertIs(socket.gethostbyname, cache._stock_gethostbyname)
+        self.assertIs(socket.create_connection, cache._create_connection)
+        self.assertSocketType(cache._SocketType)
+
+
+class TestScopes(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(cache.uninstall)
+
+    def test_installed_restores_the_previous_state(self):
+        cache.install(socket_type=False)
+
+        with cache.installed(socket_type=True):
+            self.assertIs(socket.SocketType, cache.SocketType)
+
+        self.assertIs(socket.getaddrinfo, cache.getaddrinfo)
+        self.assertIs(socket.SocketType, cache._SocketType)
+
+    def test_installed_as_a_decorator(self):
+        @cache.installed(socket_type=False)
+        def patched():
+            return socket.gethostbyname
+
+        self.assertIs(patched(), cache.gethostbyname)
+        self.assertIs(socket.gethostbyname, cache._stock_gethostbyname)
+
+    def test_overlays_come_first_and_nest(self):
+        cache.update({'first.machine.example.org': '1.1.1.1', 'second.machine.example.org': '2.2.2.2'})
+
+        with cache.overlay({'first.machine.example.org': '10.0.0.1'}):
+            with cache.overlay({'second.machine.example.org': '10.0.0.2'}):
+                self.assertEqual(cache.gethostbyname('first.machine.example.org'), '10.0.0.1')
+                self.assertEqual(cache.gethostbyname('second.machine.example.org'), '10.0.0.2')
+            self.assertEqual(cache.gethostbyname('second.machine.example.org'), '2.2.2.2')
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+
+    def test_overlays_are_local_to_each_thread(self):
+        results = {}
+        ready = threading.Barrier(2) if hasattr(threading, 'Barrier') else None
+
+        def resolve(address):
+            with cache.overlay({'first.machine.example.org': address}):
+                if ready is not None:
+                    ready.wait(5)
+                results[address] = cache.gethostbyname('first.machine.example.org')
+
+        threads = [threading.Thread(target=resolve, args=(address,)) for address in ('10.0.0.1', '10.0.0.2')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertDictEqual(results, {'10.0.0.1': '10.0.0.1', '10.0.0.2': '10.0.0.2'})
+
+    @mock.patch("hostsresolver.cache._numeric_getaddrinfo")
+    @mock.patch("hostsresolver.cache._getaddrinfo")
+    def test_overlay_answers_are_not_cached(self, getaddrinfo_mock, numeric_mock):
+        with cache.overlay({'first.machine.example.org': '10.0.0.1'}):
+            cache.getaddrinfo('first.machine.example.org', 80)
+
+        cache.getaddrinfo('first.machine.example.org', 80)
+
+        numeric_mock.assert_called_once_with('10.0.0.1', 80, 0, 0, 0, socket.AI_NUMERICHOST)
+        getaddrinfo_mock.assert_called_once_with('first.machine.example.org', 80, 0, 0, 0, 0)
+
+    def test_overlay_as_a_decorator(self):
+        @cache.overlay({'first.machine.example.org': '10.0.0.1'})
+        def resolve():
+            return cache.gethostbyname('first.machine.example.org')
+
+        self.assertEqual(resolve(), '10.0.0.1')
+
+
+class TestHappyEyeballs(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(self.listener.close)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(8)
+        self.port = self.listener.getsockname()[1]
+
+        patcher = mock.patch("hostsresolver.cache._getaddrinfo")
+        self.getaddrinfo_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def addresses(self, *addresses):
+        return [(socket.AF_INET6 if ':' in address else socket.AF_INET, socket.SOCK_STREAM, 6, '',
+                 (address, self.port)) for address in addresses]
+
+    def test_every_address_is_tried(self):
+        # Nothing listens on 127.0.0.2 for this port.
+        self.getaddrinfo_mock.return_value = self.addresses('127.0.0.2', '127.0.0.1')
+
+        sock = cache.create_connection(('first.machine.example.org', self.port), 5)
+        self.addCleanup(sock.close)
+
+        self.assertEqual(sock.getpeername(), ('127.0.0.1', self.port))
+
+    def test_the_address_connected_to_is_tried_first(self):
+        self.getaddrinfo_mock.return_value = self.addresses('127.0.0.2', '127.0.0.1')
+
+        cache.create_connection(('first.machine.example.org', self.port), 5).close()
+
+        self.assertListEqual([info[4][0] for info in cache._connection_candidates('first.machine.example.org',
+                                                                                  self.port)],
+                             ['127.0.0.1', '127.0.0.2'])
+
+    def test_families_are_interleaved(self):
+        self.getaddrinfo_mock.return_value = self.addresses('2001:db8::1', '2001:db8::2', '10.0.0.1', '10.0.0.2')
+
+        self.assertListEqual([info[4][0] for info in cache._connection_candidates('first.machine.example.org',
+                                                                                  self.port)],
+                             ['2001:db8::1', '10.0.0.1', '2001:db8::2', '10.0.0.2'])
+
+    @mock.patch("hostsresolver.cache._connect_attempt")
+    def test_slow_addresses_do_not_hold_the_next_ones(self, attempt_mock):
+        released = threading.Event()
+        self.addCleanup(released.set)
+        connected = mock.Mock()
+
+        def attempt(info, timeout, source_address):
+            if info[4][0] == '10.0.0.1':
+                released.wait(5)
+                raise socket.timeout('timed out')
+            return connected
+        attempt_mock.side_effect = attempt
+        self.getaddrinfo_mock.return_value = self.addresses('10.0.0.1', '10.0.0.2')
+
+        self.assertIs(cache.create_connection(('first.machine.example.org', 80), attempt_delay=0.01), connected)
+
+    @mock.patch("hostsresolver.cache._connect_attempt")
+    def test_the_last_error_is_raised_when_all_attempts_fail(self, attempt_mock):
+        attempt_mock.side_effect = [socket.error('refused'), socket.timeout('timed out')]
+        self.getaddrinfo_mock.return_value = self.addresses('10.0.0.1', '10.0.0.2')
+
+        self.assertRaises(socket.timeout, cache.create_connection, ('first.machine.example.org', 80))
+
+    @mock.patch("hostsresolver.cache._connect_attempt")
+    def test_single_addresses_are_connected_to_directly(self, attempt_mock):
+        info = (socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('fe80::1', 80, 0, 2))
+        self.getaddrinfo_mock.return_value = [info]
+
+        cache.create_connection(('first.machine.example.org', 80), 5)
+
+        # The scope id of the address is kept.
+        attempt_mock.assert_called_once_with(info, 5, None)
+
+    def test_names_without_addresses_fail(self):
+        self.getaddrinfo_mock.return_value = []
+
+        with self.assertRaises(socket.error) as context:
+            cache.create_connection(('first.machine.example.org', 80))
+        self.assertEqual(str(context.exception), 'getaddrinfo returns an empty list')
+
+    @unittest.skipIf(cache._ExceptionGroup is None, 'ExceptionGroup is not available')
+    @mock.patch("hostsresolver.cache._connect_attempt")
+    def test_all_errors_are_raised_when_asked(self, attempt_mock):
+        errors = [socket.error('refused'), socket.timeout('timed out')]
+        attempt_mock.side_effect = list(errors)
+        self.getaddrinfo_mock.return_value = self.addresses('10.0.0.1', '10.0.0.2')
+
+        with self.assertRaises(cache._ExceptionGroup) as context:
+            cache.create_connection(('first.machine.example.org', 80), all_errors=True)
+        self.assertListEqual(list(context.exception.exceptions), errors)
+
+    def test_prewarm(self):
+        def getaddrinfo(host, *args):
+            if host == 'unknown.machine.example.org':
+                raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+            return self.addresses('127.0.0.1')
+        self.getaddrinfo_mock.side_effect = getaddrinfo
+
+        self.assertDictEqual(
+            cache.prewarm([('first.machine.example.org', self.port), 'unknown.machine.example.org']),
+            {'first.machine.example.org': '127.0.0.1', 'unknown.machine.example.org': None})
+
+    def test_prewarm_gives_up_after_the_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def getaddrinfo(host, *args):
+            if host == 'slow.machine.example.org':
+                release.wait(5)
+            return self.addresses('127.0.0.1')
+        self.getaddrinfo_mock.side_effect = getaddrinfo
+
+        started = time.time()
+        self.assertDictEqual(
+            cache.prewarm(['first.machine.example.org', 'slow.machine.example.org'], timeout=0.1),
+            {'first.machine.example.org': '127.0.0.1', 'slow.machine.example.org': None})
+        self.assertLess(time.time() - started, 2)
+
+    @mock.patch("hostsresolver.cache.prewarm")
+    def test_install_prewarms_with_a_timeout(self, prewarm_mock):
+        self.addCleanup(cache.uninstall)
+
+        cache.install(prewarm_hosts=['first.machine.example.org'], prewarm_timeout=3)
+
+        prewarm_mock.assert_called_once_with(['first.machine.example.org'], timeout=3)
+
+
 class TestConnect(unittest.TestCase):
     def setUp(self):
+        cache.clear()
         cache.install()
 
     def tearDown(self):
@@ -130,8 +759,75 @@ class TestConnect(unittest.TestCase):
     def test_ignore_unresolved_hosts_and_pass_them_to_connect(self, socket_mock, gethost_mock):
         gethost_mock.side_effect = socket.gaierror
 
+        s = socket.SocketType()
+        s.connect(("unknown.example.org", 123))
+
+        socket_mock.connect.assert_called_once_with(s, ("unknown.example.org", 123))
+        gethost_mock.assert_called_once_with("unknown.example.org")
+
+    @mock.patch("hostsresolver.cache._gethostbyname")
+    @mock.patch("hostsresolver.cache._SocketType")
+    def test_unix_socket_paths_and_literal_addresses_skip_the_lookup(self, socket_mock, gethost_mock):
         s = socket.SocketType()
         s.connect(("/var/run/something", 123))
+        s.connect_ex(("1.2.3.4", 123))
+        s.connect((b"some_url", 123))
+
+        socket_mock.connect.assert_any_call(s, ("/var/run/something", 123))
+        socket_mock.connect_ex.assert_called_once_with(s, ("1.2.3.4", 123))
+        socket_mock.connect.assert_any_call(s, (b"some_url", 123))
+        self.assertFalse(gethost_mock.called)
+
+    @mock.patch("hostsresolver.cache._gethostbyname")
+    @mock.patch("hostsresolver.cache._SocketType")
+    def test_unresolved_hosts_are_not_looked_up_again(self, socket_mock, gethost_mock):
+        gethost_mock.side_effect = socket.gaierror(-2, 'Name or service not known')
+
+        s = socket.SocketType()
+        s.connect(("unknown.example.org", 123))
+        s.connect(("unknown.example.org", 123))
+
+        self.assertEqual(socket_mock.connect.call_count, 2)
+        gethost_mock.assert_called_once_with("unknown.example.org")
+
+
+class TestNegativeCache(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.configure, negative_ttl=cache.DEFAULT_NEGATIVE_TTL)
+        self.addCleanup(cache.clear)
+
+        patcher = mock.patch("hostsresolver.cache._gethostbyname")
+        self.gethost_mock = patcher.start()
+        self.gethost_mock.side_effect = socket.gaierror(-2, 'Name or service not known')
+        self.addCleanup(patcher.stop)
+
+        self.now = 1000.0
+        patcher = mock.patch("hostsresolver.cache._clock", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_lookups_are_raised_again_until_they_expire(self):
+        cache.configure(negative_ttl=2)
+
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror) as context:
+                cache.gethostbyname('unknown.example.org')
+            self.assertEqual(context.exception.args, (-2, 'Name or service not known'))
+        self.assertEqual(self.gethost_mock.call_count, 1)
+
+        self.now += 2
+        self.gethost_mock.side_effect = None
+        self.gethost_mock.return_value = '1.1.1.1'
+        self.assertEqual(cache.gethostbyname('unknown.example.org'), '1.1.1.1')
+
+    def test_overrides_take_precedence_over_failed_lookups(self):
+        self.assertRaises(socket.gaierror, cache.gethostbyname, 'unknown.example.org')
+
+        cache.update({'unknown.example.org': '1.1.1.1'})
+
+        self.assertEqual(cache.gethostbyname('unknown.example.org'), '1.1.1.1')
 
-        socket_mock.connect.assert_called_once_with(s, ("/var/run/something", 123))
-        gethost_mock.assert_called_once_with("/var/run/something")
+    def test_ipv4_literals_are_returned_without_lookup(self):
+        self.assertEqual(cache.gethostbyname('10.0.0.1'), '10.0.0.1')
+        self.assertFalse(self.gethost_mock.called)
@@ -0,0 +1,190 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributedvagrant_instance under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import mock
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from vagrant import Vagrant
+
+from hostsresolver import cache, cli, frozen_table
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.hosts_file = self.write('hosts', '1.1.1.1 first.example.org\n2.2.2.2 second.example.org\n')
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def run_cli(self, *argv, **kwargs):
+        stdout, stderr = StringIO(), StringIO()
+        code = cli.main(list(argv), stdin=StringIO(kwargs.get('stdin', '')), stdout=stdout, stderr=stderr)
+        return code, stdout.getvalue(), stderr.getvalue()
+
+    def test_resolves_the_names_read_from_stdin(self):
+        code, out, err = self.run_cli('--hosts-file', self.hosts_file, 'resolve', '--overrides-only',
+                                      stdin='first.example.org\n\n# comment\nsecond.example.org\n')
+
+        self.assertEqual(0, code)
+        self.assertEqual('1.1.1.1\tfirst.example.org\n2.2.2.2\tsecond.example.org\n', out)
+        self.assertEqual('', err)
+
+    def test_reports_the_names_that_failed(self):
+        with mock.patch('hostsresolver.cache._gethostbyname', side_effect=socket.gaierror(-2, 'unknown')):
+            code, out, err = self.run_cli('--hosts-file', self.hosts_file, 'resolve', 'first.example.org',
+                                          'missing.example.org')
+
+        self.assertEqual(2, code)
+        self.assertEqual('1.1.1.1\tfirst.example.org\n', out)
+        self.assertIn('missing.example.org', err)
+
+    def test_resolves_ipv6_overrides(self):
+        hosts_file = self.write('ipv6', '2001:db8::1 v6.test\n')
+
+        code, out, err = self.run_cli('--hosts-file', hosts_file, 'resolve', 'v6.test')
+
+        self.assertEqual(0, code)
+        self.assertEqual('2001:db8::1\tv6.test\n', out)
+
+    def test_sources_given_last_win(self):
+        other = self.write('other', '3.3.3.3 first.example.org\n')
+
+        code, out, err = self.run_cli('--hosts-file', self.hosts_file, '--hosts-file', other,
+                                      'resolve', '--overrides-only', 'first.example.org')
+
+        self.assertEqual('3.3.3.3\tfirst.example.org\n', out)
+
+    def test_exports_a_hosts_file(self):
+        code, out, err = self.run_cli('--hosts-file', self.hosts_file, 'export')
+
+        self.assertEqual('1.1.1.1\tfirst.example.org\n2.2.2.2\tsecond.example.org\n', out)
+
+    def test_exports_json(self):
+        output = os.path.join(self.directory, 'hosts.json')
+
+        self.run_cli('--hosts-file', self.hosts_file, 'export', '--format', 'json', '--output', output)
+
+        with open(output) as file:
+            self.assertEqual({'first.example.org': '1.1.1.1', 'second.example.org': '2.2.2.2'}, json.load(file))
+
+    def test_exports_a_frozen_table(self):
+        output = os.path.join(self.directory, 'hosts.table')
+
+        self.run_cli('--hosts-file', self.hosts_file, 'export', '--format', 'binary', '--output', output)
+
+        table = frozen_table.load(output)
+        self.addCleanup(table.close)
+        self.assertEqual({'first.example.org': '1.1.1.1', 'second.example.org': '2.2.2.2'}, dict(table))
+
+    def test_binary_exports_need_a_file(self):
+        with mock.patch('sys.stderr', StringIO()):
+            with self.assertRaises(SystemExit):
+                self.run_cli('export', '--format', 'binary')
+
+    def test_sources_that_cannot_be_loaded_are_reported(self):
+        stderr = StringIO()
+        with mock.patch('sys.stderr', stderr):
+            with self.assertRaises(SystemExit) as context:
+                self.run_cli('--hosts-file', os.path.join(self.directory, 'missing'), 'profile')
+
+        self.assertEqual(context.exception.code, 1)
+        self.assertIn('could not load the sources', stderr.getvalue())
+
+    @mock.patch('hostsresolver.cli.vagrant_source.known_hosts')
+    def test_failing_vagrant_commands_are_reported(self, known_hosts):
+        known_hosts.side_effect = subprocess.CalledProcessError(1, ['vagrant', 'ssh-config'])
+
+        with mock.patch('sys.stderr', StringIO()):
+            with self.assertRaises(SystemExit) as context:
+                self.run_cli('--vagrant', self.directory, 'export')
+
+        self.assertEqual(context.exception.code, 1)
+
+    def test_missing_vagrant_executables_are_reported(self):
+        vagrant_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vagrant_project')
+        missing = RuntimeError('The Vagrant executable cannot be found.')
+
+        with mock.patch.object(Vagrant, '_run_vagrant_command', side_effect=missing):
+            with mock.patch('sys.stderr', StringIO()) as stderr:
+                with self.assertRaises(SystemExit) as context:
+                    self.run_cli('--vagrant', vagrant_root, 'profile')
+
+        self.assertEqual(context.exception.code, 1)
+        self.assertIn('The Vagrant executable cannot be found', stderr.getvalue())
+
+    def test_hostmanager_projects_without_machines_are_reported(self):
+        self.write('Vagrantfile', '')
+
+        with mock.patch('sys.stderr', StringIO()) as stderr:
+            with self.assertRaises(SystemExit) as context:
+                self.run_cli('--hostmanager', self.directory, 'export')
+
+        self.assertEqual(context.exception.code, 1)
+        self.assertIn('No Vagrant machine', stderr.getvalue())
+
+    @mock.patch('hostsresolver.cli.vagrant_source.known_hosts')
+    def test_profiles_each_source(self, known_hosts):
+        def load(root, **kwargs):
+            Vagrant._run_vagrant_command(None, ['ssh-config'])
+            return {'machine': '10.0.0.1'}
+        known_hosts.side_effect = load
+
+        with mock.patch.object(Vagrant, '_run_vagrant_command'):
+            code, out, err = self.run_cli('--hosts-file', self.hosts_file, '--vagrant', self.directory, 'profile')
+
+        lines = out.splitlines()
+        self.assertEqual(['source', 'entries', 'total', 'subprocess', 'commands', 'parse'], lines[0].split())
+        self.assertEqual(['hostsfile:{}'.format(self.hosts_file), '2'], lines[1].split()[:2])
+        self.assertEqual(['vagrant:{}'.format(self.directory), '1'], lines[2].split()[:2])
+        self.assertEqual('1', lines[2].split()[4])
+
+    def test_timings_go_to_stderr(self):
+        code, out, err = self.run_cli('--timings', '--hosts-file', self.hosts_file, 'export')
+
+        self.assertIn('hostsfile:{}'.format(self.hosts_file), err)
+        self.assertNotIn('hostsfile:', out)
+
+
+class TestCommandTimer(unittest.TestCase):
+    def test_counts_overlapping_commands_once(self):
+        with mock.patch.object(Vagrant, '_run_vagrant_command') as run:
+            with mock.patch('hostsresolver.cli._timer', side_effect=[0.0, 5.0]):
+                with cli.CommandTimer() as timer:
+                    def nested(vagrant, args):
+                        if args == ['outer']:
+                            Vagrant._run_vagrant_command(vagrant, ['inner'])
+                    run.side_effect = nested
+                    Vagrant._run_vagrant_command(None, ['outer'])
+
+            self.assertIs(run, Vagrant._run_vagrant_command)
+        self.assertEqual(2, timer.commands)
+        self.assertEqual(5.0, timer.elapsed)
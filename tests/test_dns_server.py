@@ -0,0 +1,190 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributedvagrant_instance under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import unittest
+
+from hostsresolver import cache, dns_server
+
+
+class FakeUpstream(object):
+    """A name server on loopback answering every A query with 8.8.4.4."""
+
+    def __init__(self, ttl=60, rcode=dns_server.RCODE_NOERROR):
+        self.ttl = ttl
+        self.rcode = rcode
+        self.queries = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = self.sock.getsockname()
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                data, client = self.sock.recvfrom(512)
+            except socket.error:
+                return
+            query = dns_server.parse_query(data)
+            self.queries.append(query.name)
+            addresses = ['8.8.4.4'] if self.rcode == dns_server.RCODE_NOERROR else []
+            self.sock.sendto(dns_server._build_response(query, self.rcode, addresses, self.ttl), client)
+
+    def close(self):
+        self.sock.close()
+
+
+class TestDNSServer(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.upstream = FakeUpstream()
+        self.addCleanup(self.upstream.close)
+        self.server = dns_server.start(('127.0.0.1', 0), [self.upstream.address], timeout=0.5)
+        self.addCleanup(self.server.stop)
+
+    def ask(self, name, type=dns_server.TYPE_A, id=1234):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.settimeout(5)
+            sock.sendto(dns_server.build_query(name, type, id), self.server.address)
+            return dns_server.parse_response(sock.recv(512))
+        finally:
+            sock.close()
+
+    def ask_tcp(self, name, type=dns_server.TYPE_A, id=1234):
+        sock = socket.create_connection(self.server.address, 5)
+        try:
+            query = dns_server.build_query(name, type, id)
+            sock.sendall(struct.pack('!H', len(query)) + query)
+            length, = struct.unpack('!H', dns_server._recv_exactly(sock, 2))
+            return dns_server.parse_response(dns_server._recv_exactly(sock, length))
+        finally:
+            sock.close()
+
+    def addresses(self, response):
+        return [answer.data for answer in response.answers]
+
+    def test_overrides_are_answered_locally(self):
+        cache.update({'first.machine.example.org': '1.1.1.1', 'second.machine.example.org': '2001:db8::1'})
+
+        response = self.ask('first.machine.example.org')
+        self.assertEqual(response.id, 1234)
+        self.assertEqual(response.rcode, dns_server.RCODE_NOERROR)
+        self.assertListEqual(self.addresses(response), ['1.1.1.1'])
+        self.assertEqual(response.answers[0].ttl, dns_server.DEFAULT_ANSWER_TTL)
+
+        self.assertListEqual(self.addresses(self.ask('second.machine.example.org', dns_server.TYPE_AAAA)),
+                             ['2001:db8::1'])
+        self.assertListEqual(self.upstream.queries, [])
+
+    def test_overridden_names_have_no_address_of_the_other_family(self):
+        cache.update({'first.machine.example.org': '1.1.1.1'})
+
+        response = self.ask('first.machine.example.org', dns_server.TYPE_AAAA)
+
+        self.assertEqual(response.rcode, dns_server.RCODE_NOERROR)
+        self.assertListEqual(response.answers, [])
+        self.assertListEqual(self.upstream.queries, [])
+
+    def test_zone_indexes_are_left_out_of_the_answers(self):
+        cache.update({'link.machine.example.org': 'fe80::1%eth0'})
+
+        response = self.ask('link.machine.example.org', dns_server.TYPE_AAAA)
+
+        self.assertEqual(response.rcode, dns_server.RCODE_NOERROR)
+        self.assertListEqual(self.addresses(response), ['fe80::1'])
+
+    def test_invalid_overrides_are_a_server_failure(self):
+        cache.update({'broken.machine.example.org': '1.1.1'})
+
+        response = self.ask('broken.machine.example.org')
+
+        self.assertEqual(response.rcode, dns_server.RCODE_SERVFAIL)
+        self.assertListEqual(self.upstream.queries, [])
+
+    def test_names_are_not_case_sensitive(self):
+        cache.update({'*.svc.test': '10.0.0.5', 'first.machine.example.org': '1.1.1.1'})
+
+        self.assertListEqual(self.addresses(self.ask('Keystone.SVC.test')), ['10.0.0.5'])
+        self.assertListEqual(self.addresses(self.ask('FIRST.machine.example.org')), ['1.1.1.1'])
+
+    def test_misses_are_forwarded_and_cached(self):
+        first = self.ask('unknown.example.org', id=1)
+        second = self.ask('unknown.example.org', id=2)
+
+        self.assertListEqual(self.addresses(first), ['8.8.4.4'])
+        self.assertEqual(first.id, 1)
+        self.assertEqual(second.id, 2)
+        self.assertListEqual(self.upstream.queries, ['unknown.example.org'])
+
+    def test_responses_without_answers_are_cached_briefly(self):
+        self.upstream.rcode = dns_server.RCODE_NXDOMAIN
+
+        self.assertEqual(self.ask('unknown.example.org').rcode, dns_server.RCODE_NXDOMAIN)
+        self.assertEqual(self.ask('unknown.example.org').rcode, dns_server.RCODE_NXDOMAIN)
+
+        self.assertListEqual(self.upstream.queries, ['unknown.example.org'])
+        self.assertEqual(self.server._response_ttl(dns_server.Response(0, 0, dns_server.RCODE_NXDOMAIN, [])),
+                         cache.DEFAULT_NEGATIVE_TTL)
+
+    def test_queries_over_tcp(self):
+        cache.update({'first.machine.example.org': '1.1.1.1'})
+
+        self.assertListEqual(self.addresses(self.ask_tcp('first.machine.example.org')), ['1.1.1.1'])
+
+    def test_unreachable_upstream_is_a_server_failure(self):
+        self.upstream.close()
+        self.server.upstream = [('127.0.0.1', 9)]
+
+        response = self.ask('unknown.example.org')
+
+        self.assertEqual(response.rcode, dns_server.RCODE_SERVFAIL)
+
+    def test_long_answers_are_truncated_over_udp(self):
+        query = dns_server.Query(1, 0x0100, 'first.machine.example.org', dns_server.TYPE_A, dns_server.CLASS_IN,
+                                 dns_server.build_query('first.machine.example.org')[12:])
+
+        response = dns_server.parse_response(dns_server._build_response(
+            query, dns_server.RCODE_NOERROR, ['10.0.0.{}'.format(i) for i in range(100)], limit=512))
+
+        self.assertTrue(response.flags & 0x0200)
+        self.assertEqual(len(response.answers), 29)
+
+    def test_malformed_queries_are_rejected(self):
+        self.assertEqual(dns_server.parse_response(self.server.handle(b'\x00\x01\x01\x00\xff', 'udp')).rcode,
+                         dns_server.RCODE_FORMERR)
+        self.assertIsNone(self.server.handle(b'\x00', 'udp'))
+
+
+class TestNameservers(unittest.TestCase):
+    def test_nameservers_are_read_from_resolv_conf(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'resolv.conf')
+        with open(path, 'w') as f:
+            f.write('# comment\nsearch example.org\nnameserver 10.0.0.53\nnameserver 2001:db8::53\n')
+
+        self.assertListEqual(dns_server.nameservers(path), [('10.0.0.53', 53), ('2001:db8::53', 53)])
+
+    def test_missing_resolv_conf(self):
+        self.assertListEqual(dns_server.nameservers('/nonexistent/resolv.conf'), [])
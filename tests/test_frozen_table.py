@@ -0,0 +1,121 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributedvagrant_instance under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from hostsresolver import cache, frozen_table, hostsfile_source
+
+
+class TestFrozenTable(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.directory = directory
+        self.hosts = {'first.machine.example.org': '1.1.1.1', 'second.machine.example.org': '2001:db8::1',
+                      'third.machine.example.org': '1.1.1.1'}
+
+    def test_names_are_found(self):
+        table = frozen_table.build(self.hosts)
+
+        self.assertDictEqual(dict(table), self.hosts)
+        self.assertEqual(len(table), 3)
+        self.assertIsNone(table.get('unknown.machine.example.org'))
+        self.assertIsNone(table.get(b'\xff'))
+        self.assertIsNone(table.get(None))
+
+    def test_addresses_are_stored_once(self):
+        table = frozen_table.build(self.hosts)
+
+        self.assertEqual(len(table._ipv4), 1)
+        self.assertEqual(len(table._ipv6), 16)
+
+    def test_first_address_of_a_name_wins(self):
+        table = frozen_table.build([('first.machine.example.org', '1.1.1.1'),
+                                    ('first.machine.example.org', '2.2.2.2')])
+
+        self.assertDictEqual(dict(table), {'first.machine.example.org': '1.1.1.1'})
+
+    def test_addresses_with_a_zone_index_are_left_out(self):
+        table = frozen_table.build([('link.machine.example.org', 'fe80::1%eth0'),
+                                    ('first.machine.example.org', '1.1.1.1')])
+
+        self.assertDictEqual(dict(table), {'first.machine.example.org': '1.1.1.1'})
+
+    def test_names_that_are_not_ascii(self):
+        path = os.path.join(self.directory, 'hosts.table')
+        frozen_table.build({u'caf\xe9.example.org': '1.1.1.1'}).save(path)
+
+        table = frozen_table.load(path)
+        self.addCleanup(table.close)
+
+        self.assertEqual(table.get(u'caf\xe9.example.org'), '1.1.1.1')
+        self.assertListEqual(list(table), [u'caf\xe9.example.org'])
+
+    def test_empty_table(self):
+        table = frozen_table.build({})
+
+        self.assertEqual(len(table), 0)
+        self.assertIsNone(table.get('first.machine.example.org'))
+
+    def test_saved_tables_are_mapped(self):
+        path = os.path.join(self.directory, 'hosts.table')
+        frozen_table.build(self.hosts).save(path)
+
+        table = frozen_table.load(path)
+        self.addCleanup(table.close)
+
+        self.assertDictEqual(dict(table), self.hosts)
+        self.assertIsNone(table.get('unknown.machine.example.org'))
+
+    def test_saving_a_loaded_table(self):
+        path = os.path.join(self.directory, 'hosts.table')
+        frozen_table.build(self.hosts).save(path)
+        table = frozen_table.load(path)
+        self.addCleanup(table.close)
+
+        table.save(path + '.copy')
+        copy = frozen_table.load(path + '.copy')
+        self.addCleanup(copy.close)
+
+        self.assertDictEqual(dict(copy), self.hosts)
+
+    def test_other_files_are_rejected(self):
+        path = os.path.join(self.directory, 'hosts.table')
+        with open(path, 'wb') as file:
+            file.write(b'\0' * 64)
+
+        self.assertRaises(ValueError, frozen_table.load, path)
+
+
+class TestCompactHostsFile(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(cache.uninstall)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.hosts_file_path = os.path.join(directory, 'hosts')
+        with open(self.hosts_file_path, 'w') as file:
+            file.write('1.1.1.1 first.machine.example.org\n2.2.2.2 second.machine.example.org\n'
+                       'fe80::1%eth0 link.machine.example.org\n')
+
+    def test_names_are_loaded_in_a_frozen_table(self):
+        table = hostsfile_source.install(self.hosts_file_path, compact=True)
+
+        self.assertIsInstance(table, frozen_table.FrozenTable)
+        self.assertEqual(cache.gethostbyname('second.machine.example.org'), '2.2.2.2')
+        self.assertListEqual(cache.layers(), [])
@@ -12,8 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
+import shutil
+import socket
+import tempfile
+import time
 import unittest
 
+import mock
+
+from hostsresolver import cache
 from hostsresolver import hostsfile_source
 
 
@@ -92,20 +99,190 @@ class TestParseContent(unittest.TestCase):
             hostsfile_source.parse_content(hostfile_content),
             {'first.host.com': '7.7.7.2', 'second.host.com': '7.7.7.3'})
 
-    def test_parse_content_ignore_anything_but_ipv4(self):
+    def test_parse_content_with_ipv6(self):
         hostfile_content = '''
         ::1     ip6-localhost ip6-loopback
         fe00::0 ip6-localnet
-        ff00::0 ip6-mcastprefix
         ff02::1 ip6-allnodes
-        ff02::2 ip6-allrouters
-        7.7.7.2 first.host.com
+        2001:db8::1 first.host.com
+        fe80::1%eth0 second.host.com
+        ::ffff:7.7.7.4 third.host.com
+        '''
+        self.assertDictEqual(
+            hostsfile_source.parse_content(hostfile_content),
+            {'ip6-localnet': 'fe00::0', 'ip6-allnodes': 'ff02::1', 'first.host.com': '2001:db8::1',
+             'second.host.com': 'fe80::1%eth0', 'third.host.com': '::ffff:7.7.7.4'})
+
+    def test_parse_content_ignore_invalid_addresses(self):
+        hostfile_content = '''
+        7.7.7 first.host.com
+        7.7.7.256 first.host.com
+        2001:db8:::1 first.host.com
+        my.host.com first.host.com
         7.7.7.3 second.host.com
         '''
+        self.assertDictEqual(
+            hostsfile_source.parse_content(hostfile_content),
+            {'second.host.com': '7.7.7.3'})
+
+    def test_parse_content_keeps_localhost_addresses_when_asked(self):
+        hostfile_content = '''
+        127.0.0.1 me.host.com
+        ::1 ip6-localhost
+        '''
+        self.assertDictEqual(
+            hostsfile_source.parse_content(hostfile_content, skip_loopback=False),
+            {'me.host.com': '127.0.0.1', 'ip6-localhost': '::1'})
+
+    def test_parse_content_first_address_wins(self):
+        hostfile_content = '''
+        7.7.7.2 first.host.com
+        7.7.7.3 first.host.com second.host.com
+        '''
+        self.assertDictEqual(
+            hostsfile_source.parse_content(hostfile_content),
+            {'first.host.com': '7.7.7.2', 'second.host.com': '7.7.7.3'})
+
+    def test_parse_content_with_windows_line_endings(self):
+        hostfile_content = '7.7.7.2 first.host.com\r\n7.7.7.3 second.host.com # comment\r\n'
         self.assertDictEqual(
             hostsfile_source.parse_content(hostfile_content),
             {'first.host.com': '7.7.7.2', 'second.host.com': '7.7.7.3'})
 
+    def test_parse_content_with_address_only_lines(self):
+        hostfile_content = '''
+        7.7.7.2
+        7.7.7.3 # first.host.com
+        '''
+        self.assertDictEqual(hostsfile_source.parse_content(hostfile_content), {})
+
+
+class TestKnownHosts(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.hosts_file_path = os.path.join(directory, 'hosts')
+        with open(self.hosts_file_path, 'w') as file:
+            file.write('''
+            127.0.0.1 localhost
+            7.7.7.2 first.host.com www.first.host.com
+            7.7.7.3 second.host.com first.host.com # third.host.com
+            2001:db8::4 fourth.other.com
+            ''')
+
+    def test_known_hosts(self):
+        self.assertDictEqual(
+            hostsfile_source.known_hosts(self.hosts_file_path),
+            {'first.host.com': '7.7.7.2', 'www.first.host.com': '7.7.7.2', 'second.host.com': '7.7.7.3',
+             'fourth.other.com': '2001:db8::4'})
+
+    def test_known_hosts_matching_names(self):
+        self.assertDictEqual(
+            hostsfile_source.known_hosts(self.hosts_file_path, names={'first.host.com', 'unknown.host.com'}),
+            {'first.host.com': '7.7.7.2'})
+
+    def test_known_hosts_matching_suffixes(self):
+        self.assertDictEqual(
+            hostsfile_source.known_hosts(self.hosts_file_path, suffixes='.other.com'),
+            {'fourth.other.com': '2001:db8::4'})
+        self.assertDictEqual(
+            hostsfile_source.known_hosts(self.hosts_file_path, suffixes=['www.first.host.com', '.other.com']),
+            {'www.first.host.com': '7.7.7.2', 'fourth.other.com': '2001:db8::4'})
+
+    def test_known_hosts_matching_names_or_suffixes(self):
+        self.assertDictEqual(
+            hostsfile_source.known_hosts(self.hosts_file_path, names={'second.host.com'}, suffixes=('.other.com',)),
+            {'second.host.com': '7.7.7.3', 'fourth.other.com': '2001:db8::4'})
+
+    def test_known_hosts_matches_parse_content(self):
+        with open(self.hosts_file_path) as file:
+            self.assertDictEqual(hostsfile_source.known_hosts(self.hosts_file_path),
+                                 hostsfile_source.parse_content(file.read()))
+
+    @mock.patch('hostsresolver.hostsfile_source.replace')
+    def test_install_loads_the_file_in_a_single_step(self, replace_mock):
+        hostsfile_source.install(self.hosts_file_path)
+
+        replace_mock.assert_called_once_with(
+            {'first.host.com': '7.7.7.2', 'www.first.host.com': '7.7.7.2', 'second.host.com': '7.7.7.3',
+             'fourth.other.com': '2001:db8::4'},
+            layer=hostsfile_source.layer_name(self.hosts_file_path))
+
+    def test_installing_again_keeps_the_names_resolved(self):
+        self.addCleanup(cache.clear)
+        self.addCleanup(cache.uninstall)
+        hostsfile_source.install(self.hosts_file_path)
+        cache.gethostbyname('second.host.com')
+
+        with mock.patch('hostsresolver.cache._invalidate') as invalidate_mock:
+            hostsfile_source.install(self.hosts_file_path)
+
+        self.assertNotIn(mock.call(removed=True), invalidate_mock.call_args_list)
+        self.assertEqual(cache.gethostbyname('second.host.com'), '7.7.7.3')
+
+class TestHostsFileWatcher(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.hosts_file_path = os.path.join(directory, 'hosts')
+        self._write('7.7.7.2 first.host.com\n7.7.7.3 second.host.com\n', mtime=1000)
+
+        self.watcher = hostsfile_source.HostsFileWatcher(self.hosts_file_path)
+        self.addCleanup(self.watcher.stop)
+
+    def _write(self, content, mtime):
+        with open(self.hosts_file_path, 'w') as file:
+            file.write(content)
+        os.utime(self.hosts_file_path, (mtime, mtime))
+
+    def test_first_check_loads_the_file(self):
+        self.assertTrue(self.watcher.check())
+
+        self.assertEqual(cache.gethostbyname('first.host.com'), '7.7.7.2')
+        self.assertEqual(cache.gethostbyname('second.host.com'), '7.7.7.3')
+
+    def test_unchanged_file_is_not_parsed_again(self):
+        self.watcher.check()
+
+        with mock.patch('hostsresolver.hostsfile_source.known_hosts') as known_hosts_mock:
+            self.assertFalse(self.watcher.check())
+        self.assertFalse(known_hosts_mock.called)
+
+    @mock.patch('hostsresolver.cache._gethostbyname')
+    def test_changes_are_swapped_in_and_removed_names_evicted(self, gethost_mock):
+        gethost_mock.side_effect = socket.gaierror(-2, 'Name or service not known')
+        cache.update({'other.host.com': '8.8.8.8'})
+        self.watcher.check()
+
+        self._write('7.7.7.4 first.host.com\n7.7.7.5 third.host.com\n', mtime=2000)
+        self.assertTrue(self.watcher.check())
+
+        self.assertEqual(cache.gethostbyname('first.host.com'), '7.7.7.4')
+        self.assertEqual(cache.gethostbyname('third.host.com'), '7.7.7.5')
+        self.assertEqual(cache.gethostbyname('other.host.com'), '8.8.8.8')
+        self.assertRaises(socket.gaierror, cache.gethostbyname, 'second.host.com')
+
+    def test_missing_file_keeps_the_current_names(self):
+        self.watcher.check()
+        os.unlink(self.hosts_file_path)
+
+        self.assertFalse(self.watcher.check())
+        self.assertEqual(cache.gethostbyname('first.host.com'), '7.7.7.2')
+
+    def test_install_watches_the_file_in_the_background(self):
+        watcher = hostsfile_source.install(self.hosts_file_path, watch=True, interval=0.01)
+        self.addCleanup(watcher.stop)
+        self.assertEqual(cache.gethostbyname('first.host.com'), '7.7.7.2')
+
+        self._write('7.7.7.4 first.host.com\n', mtime=2000)
+        for _ in range(500):
+            if cache.gethostbyname('first.host.com') == '7.7.7.4':
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.gethostbyname('first.host.com'), '7.7.7.4')
+
 
 class TestInstall(unittest.TestCase):
     def setUp(self):
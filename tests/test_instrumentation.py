@@ -0,0 +1,141 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributedvagrant_instance under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import unittest
+
+import mock
+
+from hostsresolver import cache, instrumentation
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        patcher = mock.patch("hostsresolver.cache._gethostbyname")
+        self.gethost_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.gethost_mock.return_value = '3.3.3.3'
+
+        instrumentation.enable()
+        self.addCleanup(instrumentation.disable)
+
+    def test_hits_and_misses_are_counted(self):
+        cache.update({'first.machine.example.org': '1.1.1.1'})
+
+        cache.gethostbyname('first.machine.example.org')
+        cache.gethostbyname('fresh.machine.example.org')
+        cache.gethostbyname('fresh.machine.example.org')
+
+        stats = instrumentation.stats()
+        self.assertTrue(stats['enabled'])
+        self.assertEqual(stats['hits']['override'], 1)
+        self.assertEqual(stats['misses']['override'], 2)
+        self.assertEqual(stats['hits']['resolved'], 1)
+        self.assertEqual(stats['misses']['resolved'], 1)
+        self.assertEqual(stats['upstream']['gethostbyname']['calls'], 1)
+        self.assertEqual(sum(count for _, count in stats['upstream']['gethostbyname']['latency']), 1)
+
+    def test_override_hits_are_counted_by_source(self):
+        cache.update({'first.machine.example.org': '1.1.1.1'}, layer='vagrant')
+        cache.update({'*.svc.test': '10.0.0.5'}, layer='rules')
+        cache.attach({'second.machine.example.org': '2.2.2.2'})
+
+        cache.gethostbyname('first.machine.example.org')
+        cache.gethostbyname('first.machine.example.org')
+        cache.gethostbyname('keystone.svc.test')
+        cache.gethostbyname('second.machine.example.org')
+
+        self.assertDictEqual(instrumentation.stats()['overrides'],
+                             {'vagrant': 2, 'rules': 1, 'table:dict': 1})
+        self.assertEqual(instrumentation.stats()['hits']['override'], 4)
+
+    def test_negative_hits_and_errors_are_counted(self):
+        self.gethost_mock.side_effect = socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror):
+                cache.gethostbyname('unknown.machine.example.org')
+
+        stats = instrumentation.stats()
+        self.assertEqual(stats['hits']['negative'], 1)
+        self.assertEqual(stats['upstream']['gethostbyname']['errors'], 1)
+
+    def test_bypassed_connections_are_counted(self):
+        sock = cache.SocketType(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+
+        sock._use_host_cache(('127.0.0.1', 80))
+        sock._use_host_cache(('fresh.machine.example.org', 80))
+
+        self.assertEqual(instrumentation.stats()['bypassed'], 1)
+
+    def test_overrides_are_not_counted_as_upstream_lookups(self):
+        events = []
+        hook = lambda *args: events.append(args[:2])
+        instrumentation.add_hook(hook)
+        self.addCleanup(instrumentation.remove_hook, hook)
+        cache.update({'first.machine.example.org': '1.1.1.1'})
+
+        cache.getaddrinfo('first.machine.example.org', 80)
+        with cache.overlay({'second.machine.example.org': '2.2.2.2'}):
+            cache.getaddrinfo('second.machine.example.org', 80)
+
+        self.assertEqual(instrumentation.stats()['upstream']['getaddrinfo']['calls'], 0)
+        self.assertNotIn('upstream', [event for event, _ in events])
+
+    def test_hooks_are_called(self):
+        events = []
+        hook = lambda *args: events.append(args[:3])
+        instrumentation.add_hook(hook)
+        self.addCleanup(instrumentation.remove_hook, hook)
+
+        cache.update({'first.machine.example.org': '1.1.1.1'})
+        cache.gethostbyname('first.machine.example.org')
+
+        self.assertListEqual(events, [('hit', 'override', 'first.machine.example.org')])
+
+    def test_disabling_restores_the_original_functions(self):
+        instrumentation.disable()
+
+        self.assertFalse(instrumentation.enabled())
+        self.assertIs(cache._gethostbyname, self.gethost_mock)
+        self.assertNotIn('get', vars(cache._resolved_cache))
+        self.assertEqual(cache.SocketType._use_host_cache.__name__, '_use_host_cache')
+
+        cache.gethostbyname('fresh.machine.example.org')
+        self.assertEqual(instrumentation.stats()['misses']['resolved'], 0)
+
+    def test_uninstalling_while_enabled_restores_the_stock_functions(self):
+        cache.install()
+        self.addCleanup(cache.uninstall)
+
+        cache.uninstall()
+        instrumentation.disable()
+
+        self.assertIs(socket.getaddrinfo, cache._stock_getaddrinfo)
+        self.assertIs(socket.gethostbyname, cache._stock_gethostbyname)
+
+    def test_evictions_are_always_counted(self):
+        instrumentation.disable()
+        cache.configure(max_size=1)
+        self.addCleanup(cache.configure, max_size=cache.DEFAULT_MAX_SIZE)
+        evictions = instrumentation.stats()['evictions']['resolved']
+
+        cache.gethostbyname('first.machine.example.org')
+        cache.gethostbyname('second.machine.example.org')
+
+        self.assertEqual(instrumentation.stats()['evictions']['resolved'], evictions + 1)
@@ -0,0 +1,145 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributedvagrant_instance under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from hostsresolver import cache, shared_table
+
+
+class TestSharedTable(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'hosts.table')
+
+    def open(self, **kwargs):
+        table = shared_table.SharedTable(self.path, **kwargs)
+        self.addCleanup(table.close)
+        return table
+
+    def test_published_names_are_found(self):
+        hosts = {'first.machine.example.org': '1.1.1.1', 'second.machine.example.org': '2001:db8::1',
+                 'third.machine.example.org': '3.3.3.3'}
+        self.assertEqual(shared_table.publish(self.path, hosts), 1)
+
+        table = self.open()
+
+        self.assertDictEqual(dict(table), hosts)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table['second.machine.example.org'], '2001:db8::1')
+        self.assertIsNone(table.get('unknown.machine.example.org'))
+        self.assertIsNone(table.get('a'))
+        self.assertIsNone(table.get('z'))
+        self.assertIsNone(table.get(b'\xff'))
+
+    def test_addresses_with_a_zone_index_are_left_out(self):
+        shared_table.publish(self.path, {'link.machine.example.org': 'fe80::1%eth0',
+                                         'first.machine.example.org': '1.1.1.1'})
+
+        table = self.open()
+
+        self.assertDictEqual(dict(table), {'first.machine.example.org': '1.1.1.1'})
+
+    def test_names_that_are_not_ascii(self):
+        shared_table.publish(self.path, {u'caf\xe9.example.org': '1.1.1.1', 'first.machine.example.org': '2.2.2.2'})
+
+        table = self.open()
+
+        self.assertEqual(table[u'caf\xe9.example.org'], '1.1.1.1')
+        self.assertEqual(table['first.machine.example.org'], '2.2.2.2')
+        self.assertIn(u'caf\xe9.example.org', list(table))
+
+    def test_empty_table(self):
+        shared_table.publish(self.path, {})
+
+        table = self.open()
+
+        self.assertEqual(len(table), 0)
+        self.assertIsNone(table.get('first.machine.example.org'))
+
+    def test_new_generations_are_followed(self):
+        shared_table.publish(self.path, {'first.machine.example.org': '1.1.1.1'})
+        changes = []
+        table = self.open(on_change=lambda: changes.append(table.generation))
+
+        self.assertEqual(shared_table.publish(self.path, {'first.machine.example.org': '2.2.2.2'}), 2)
+        self.assertEqual(table['first.machine.example.org'], '2.2.2.2')
+        self.assertEqual(shared_table.publish(self.path, {'second.machine.example.org': '3.3.3.3'}), 3)
+        self.assertEqual(table['second.machine.example.org'], '3.3.3.3')
+
+        self.assertListEqual(changes, [2, 3])
+        self.assertFalse(os.path.exists(self.path + '.1'))
+        self.assertTrue(os.path.exists(self.path + '.2'))
+
+    def test_other_processes_read_the_table(self):
+        shared_table.publish(self.path, {'first.machine.example.org': '1.1.1.1'})
+
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys; from hostsresolver import shared_table; '
+            'sys.stdout.write(shared_table.SharedTable(sys.argv[1])["first.machine.example.org"])',
+            self.path])
+
+        self.assertEqual(output, b'1.1.1.1')
+
+
+class TestCacheIntegration(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'hosts.table')
+
+    def test_published_overrides_are_resolved_from_the_table(self):
+        cache.update({'first.machine.example.org': '1.1.1.1'})
+        shared_table.publish(self.path)
+        cache.clear()
+
+        table = shared_table.SharedTable(self.path)
+        self.addCleanup(table.close)
+        cache.attach(table)
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+
+    def test_layers_come_before_the_tables(self):
+        shared_table.publish(self.path, {'first.machine.example.org': '1.1.1.1', '*.svc.test': '1.1.1.1'})
+        table = shared_table.SharedTable(self.path)
+        self.addCleanup(table.close)
+        cache.attach(table)
+
+        cache.update({'first.machine.example.org': '2.2.2.2', '*.svc.test': '10.0.0.5'})
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '2.2.2.2')
+        self.assertEqual(cache.gethostbyname('keystone.svc.test'), '10.0.0.5')
+
+    def test_publications_invalidate_cached_results(self):
+        shared_table.publish(self.path, {'first.machine.example.org': '1.1.1.1'})
+        table = shared_table.SharedTable(self.path)
+        self.addCleanup(table.close)
+        cache.attach(table)
+        generation = cache._generation
+
+        shared_table.publish(self.path, {'first.machine.example.org': '2.2.2.2'})
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '2.2.2.2')
+        self.assertGreater(cache._generation, generation)
+
+        cache.detach(table)
+        self.assertListEqual(cache._shared_tables, [])
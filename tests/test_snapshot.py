@@ -0,0 +1,106 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributedvagrant_instance under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from hostsresolver import snapshot
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'snapshot.json')
+
+    def test_saved_hosts_are_loaded_with_the_same_fingerprint(self):
+        snapshot.save(self.path, 'abc', {'first.machine.example.org': '1.1.1.1'})
+
+        self.assertDictEqual(snapshot.load(self.path, 'abc'), {'first.machine.example.org': '1.1.1.1'})
+
+    def test_nothing_is_loaded_with_another_fingerprint(self):
+        snapshot.save(self.path, 'abc', {'first.machine.example.org': '1.1.1.1'})
+
+        self.assertIsNone(snapshot.load(self.path, 'def'))
+
+    def test_nothing_is_loaded_from_a_missing_or_corrupted_file(self):
+        self.assertIsNone(snapshot.load(self.path, 'abc'))
+
+        with open(self.path, 'w') as file:
+            file.write('{"version": 1, "finger')
+        self.assertIsNone(snapshot.load(self.path, 'abc'))
+
+    def test_saving_leaves_no_temporary_file(self):
+        snapshot.save(self.path, 'abc', {})
+        snapshot.save(self.path, 'def', {})
+
+        self.assertListEqual(os.listdir(self.directory), ['snapshot.json'])
+
+    def test_failed_writes_keep_the_previous_file(self):
+        snapshot.save(self.path, 'abc', {'first.machine.example.org': '1.1.1.1'})
+
+        def parts():
+            yield b'partial'
+            raise IOError('disk full')
+        self.assertRaises(IOError, snapshot.write_atomically, self.path, parts())
+
+        self.assertDictEqual(snapshot.load(self.path, 'abc'), {'first.machine.example.org': '1.1.1.1'})
+        self.assertListEqual(os.listdir(self.directory), ['snapshot.json'])
+
+
+class TestPackAddress(unittest.TestCase):
+    def test_addresses_are_packed_with_their_family(self):
+        self.assertEqual(snapshot.pack_address('first.machine.example.org', '1.1.1.1'),
+                         (socket.AF_INET, b'\x01\x01\x01\x01'))
+        self.assertEqual(snapshot.pack_address('second.machine.example.org', '::1'),
+                         (socket.AF_INET6, b'\x00' * 15 + b'\x01'))
+
+    def test_addresses_that_cannot_be_packed_are_left_out(self):
+        self.assertIsNone(snapshot.pack_address('link.machine.example.org', 'fe80::1%eth0'))
+        self.assertIsNone(snapshot.pack_address('broken.machine.example.org', '1.1.1'))
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'id')
+        with open(self.path, 'w') as file:
+            file.write('first')
+
+    def test_fingerprint_is_stable(self):
+        self.assertEqual(snapshot.fingerprint([self.path]), snapshot.fingerprint([self.path]))
+
+    def test_fingerprint_changes_with_the_content(self):
+        before = snapshot.fingerprint([self.path])
+        stat = os.stat(self.path)
+        with open(self.path, 'w') as file:
+            file.write('other')
+        os.utime(self.path, (stat.st_atime, stat.st_mtime))
+
+        self.assertNotEqual(snapshot.fingerprint([self.path]), before)
+
+    def test_fingerprint_changes_with_the_modification_time(self):
+        before = snapshot.fingerprint([self.path])
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+
+        self.assertNotEqual(snapshot.fingerprint([self.path]), before)
+
+    def test_fingerprint_changes_with_extra_values(self):
+        self.assertNotEqual(snapshot.fingerprint([self.path], 'vagrant'),
+                            snapshot.fingerprint([self.path], 'hostmanager'))
@@ -14,6 +14,10 @@
 
 import mock
 import os
+import shutil
+import subprocess
+import tempfile
+import threading
 import unittest
 
 from hostsresolver import vagrant_hostmanager_source
@@ -57,6 +61,117 @@ class TestKnownHosts(unittest.TestCase):
         self.vagrant_instance._run_vagrant_command.assert_called_with(
             ('ssh', 'first.machine.example.org', '-c', 'cat /etc/hosts'))
 
+    def test_projects_without_machines_are_reported(self):
+        vagrant_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, vagrant_root)
+        open(os.path.join(vagrant_root, 'Vagrantfile'), 'w').close()
+
+        self.assertRaises(RuntimeError, vagrant_hostmanager_source.known_hosts, vagrant_root=vagrant_root)
+
+
+class TestParallelKnownHosts(unittest.TestCase):
+    def setUp(self):
+        self.valid_vagrant_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vagrant_project')
+        self.vagrant_instance = mock.Mock()
+        patcher = mock.patch('hostsresolver.vagrant_hostmanager_source.Vagrant')
+        patcher.start().return_value = self.vagrant_instance
+        self.addCleanup(patcher.stop)
+
+        self.released = threading.Event()
+        self.addCleanup(self.released.set)
+        self.responses = {}
+        self.vagrant_instance._run_vagrant_command.side_effect = self.run_vagrant_command
+
+    def run_vagrant_command(self, command):
+        response = self.responses[command[1]]
+        if response is None:
+            # A straggler, answering only once the test is over.
+            self.released.wait(5)
+            return ''
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def test_first_answer_is_used(self):
+        self.responses = {'first.machine.example.org': None,
+                          'second.machine.example.org': '2.3.4.5 second.machine.example.org'}
+
+        self.assertDictEqual(
+            vagrant_hostmanager_source.known_hosts(self.valid_vagrant_root,
+                                                   names=vagrant_hostmanager_source.ALL_MACHINES),
+            {'second.machine.example.org': '2.3.4.5'})
+
+    def test_failed_machines_are_skipped(self):
+        self.responses = {'first.machine.example.org': subprocess.CalledProcessError(255, 'vagrant ssh'),
+                          'second.machine.example.org': '2.3.4.5 second.machine.example.org'}
+
+        self.assertDictEqual(
+            vagrant_hostmanager_source.known_hosts(self.valid_vagrant_root,
+                                                   names=['first.machine.example.org',
+                                                          'second.machine.example.org']),
+            {'second.machine.example.org': '2.3.4.5'})
+
+    @mock.patch('hostsresolver.vagrant_hostmanager_source.logger')
+    def test_answers_are_merged_and_conflicts_reported(self, logger_mock):
+        self.responses = {
+            'first.machine.example.org': '1.1.1.1 first.machine.example.org\n1.1.1.2 shared.example.org',
+            'second.machine.example.org': '2.3.4.5 second.machine.example.org\n2.2.2.2 shared.example.org'}
+
+        self.assertDictEqual(
+            vagrant_hostmanager_source.known_hosts(self.valid_vagrant_root,
+                                                   names=['second.machine.example.org',
+                                                          'first.machine.example.org'],
+                                                   merge=True),
+            {'first.machine.example.org': '1.1.1.1', 'second.machine.example.org': '2.3.4.5',
+             'shared.example.org': '2.2.2.2'})
+        self.assertEqual(logger_mock.warning.call_count, 1)
+
+    def test_stragglers_time_out(self):
+        self.responses = {'first.machine.example.org': None,
+                          'second.machine.example.org': '2.3.4.5 second.machine.example.org'}
+
+        self.assertDictEqual(
+            vagrant_hostmanager_source.known_hosts(self.valid_vagrant_root,
+                                                   names=vagrant_hostmanager_source.ALL_MACHINES,
+                                                   merge=True, timeout=0.1),
+            {'second.machine.example.org': '2.3.4.5'})
+
+    @mock.patch('hostsresolver.vagrant_hostmanager_source.logger')
+    def test_unknown_machine_falls_back_with_a_warning(self, logger_mock):
+        self.responses = {'first.machine.example.org': '1.1.1.1 first.machine.example.org',
+                          'second.machine.example.org': '1.1.1.1 first.machine.example.org'}
+
+        vagrant_hostmanager_source.known_hosts(self.valid_vagrant_root, name='unknown.machine.example.org')
+
+        self.assertEqual(logger_mock.warning.call_count, 1)
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.vagrant_root = os.path.join(directory, 'vagrant_project')
+        shutil.copytree(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vagrant_project'),
+                        self.vagrant_root)
+
+        self.vagrant_instance = mock.Mock()
+        patcher = mock.patch('hostsresolver.vagrant_hostmanager_source.Vagrant')
+        patcher.start().return_value = self.vagrant_instance
+        self.addCleanup(patcher.stop)
+        self.vagrant_instance._run_vagrant_command.return_value = '1.1.1.1 first.machine.example.org'
+
+    def test_snapshot_is_reused_for_the_same_machine(self):
+        vagrant_hostmanager_source.known_hosts(self.vagrant_root, name='first.machine.example.org', snapshot=True)
+
+        self.assertDictEqual(
+            vagrant_hostmanager_source.known_hosts(self.vagrant_root, name='first.machine.example.org',
+                                                   snapshot=True),
+            {'first.machine.example.org': '1.1.1.1'})
+        self.assertEqual(self.vagrant_instance._run_vagrant_command.call_count, 1)
+
+        vagrant_hostmanager_source.known_hosts(self.vagrant_root, name='second.machine.example.org', snapshot=True)
+        self.assertEqual(self.vagrant_instance._run_vagrant_command.call_count, 2)
+
 
 class TestInstall(unittest.TestCase):
     def setUp(self):
@@ -14,9 +14,14 @@
 
 import mock
 import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
 import unittest
 
-from hostsresolver import vagrant_source
+from hostsresolver import cache, vagrant_source
 
 
 class TestFindVagrantRoot(unittest.TestCase):
@@ -92,6 +97,7 @@ class TestKnownHosts(unittest.TestCase):
     def setUp(self):
         self.valid_vagrant_root = _resource_path('vagrant_project')
         self.vagrant_instance = mock.Mock()
+        self.vagrant_instance.ssh_config.return_value = ''
         patcher = mock.patch('hostsresolver.vagrant_source.Vagrant')
         patcher.start().return_value = self.vagrant_instance
         self.addCleanup(patcher.stop)
@@ -105,10 +111,329 @@ class TestKnownHosts(unittest.TestCase):
             known_hosts)
 
 
+class TestParseSshConfig(unittest.TestCase):
+    def test_every_host_is_mapped_to_its_hostname(self):
+        ssh_config = '''Host first.machine.example.org
+  HostName 1.1.1.1
+  User vagrant
+  Port 22
+  IdentityFile "/home/user/.ssh/id_rsa"
+
+Host second.machine.example.org
+  HostName "2.3.4.5"
+  User vagrant
+'''
+        self.assertDictEqual(
+            vagrant_source.parse_ssh_config(ssh_config),
+            {'first.machine.example.org': '1.1.1.1', 'second.machine.example.org': '2.3.4.5'})
+
+    def test_hosts_without_hostname_are_left_out(self):
+        self.assertDictEqual(
+            vagrant_source.parse_ssh_config('Host first.machine.example.org\n  User vagrant\n'),
+            {})
+
+
+class TestBulkKnownHosts(unittest.TestCase):
+    def setUp(self):
+        self.valid_vagrant_root = _resource_path('vagrant_project')
+        self.vagrant_instance = mock.Mock()
+        patcher = mock.patch('hostsresolver.vagrant_source.Vagrant')
+        patcher.start().return_value = self.vagrant_instance
+        self.addCleanup(patcher.stop)
+
+    def test_all_machines_are_resolved_with_a_single_command(self):
+        self.vagrant_instance.ssh_config.return_value = (
+            'Host first.machine.example.org\n  HostName 1.1.1.1\n'
+            'Host second.machine.example.org\n  HostName 2.3.4.5\n'
+            'Host unknown.machine.example.org\n  HostName 3.3.3.3\n')
+
+        self.assertDictEqual(
+            vagrant_source.known_hosts(vagrant_root=self.valid_vagrant_root),
+            {'first.machine.example.org': '1.1.1.1', 'second.machine.example.org': '2.3.4.5'})
+        self.vagrant_instance.ssh_config.assert_called_once_with()
+        self.assertFalse(self.vagrant_instance.hostname.called)
+
+    def test_machines_missing_from_the_output_are_resolved_one_by_one(self):
+        self.vagrant_instance.ssh_config.return_value = 'Host first.machine.example.org\n  HostName 1.1.1.1\n'
+        self.vagrant_instance.hostname.return_value = '2.3.4.5'
+
+        self.assertDictEqual(
+            vagrant_source.known_hosts(vagrant_root=self.valid_vagrant_root),
+            {'first.machine.example.org': '1.1.1.1', 'second.machine.example.org': '2.3.4.5'})
+        self.vagrant_instance.hostname.assert_called_once_with('second.machine.example.org')
+
+    def test_machines_are_resolved_one_by_one_when_the_command_fails(self):
+        self.vagrant_instance.ssh_config.side_effect = subprocess.CalledProcessError(1, 'vagrant ssh-config')
+        self.vagrant_instance.hostname.side_effect = {'first.machine.example.org': '1.1.1.1',
+                                                      'second.machine.example.org': '2.3.4.5'}.get
+
+        self.assertDictEqual(
+            vagrant_source.known_hosts(vagrant_root=self.valid_vagrant_root),
+            {'first.machine.example.org': '1.1.1.1', 'second.machine.example.org': '2.3.4.5'})
+        self.assertEqual(self.vagrant_instance.hostname.call_count, 2)
+
+
+class TestParallelKnownHosts(unittest.TestCase):
+    def setUp(self):
+        self.valid_vagrant_root = _resource_path('vagrant_project')
+        self.vagrant_instance = mock.Mock()
+        self.vagrant_instance.ssh_config.return_value = ''
+        patcher = mock.patch('hostsresolver.vagrant_source.Vagrant')
+        patcher.start().return_value = self.vagrant_instance
+        self.addCleanup(patcher.stop)
+
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def test_machines_are_resolved_concurrently(self):
+        running = []
+
+        def hostname(machine):
+            running.append(machine)
+            self.release.wait(5)
+            return '1.1.1.1'
+        self.vagrant_instance.hostname.side_effect = hostname
+
+        def release_when_both_running():
+            while len(running) < 2:
+                time.sleep(0.001)
+            self.release.set()
+        threading.Thread(target=release_when_both_running).start()
+
+        self.assertDictEqual(
+            vagrant_source.known_hosts(vagrant_root=self.valid_vagrant_root, workers=2, timeout=5),
+            {'first.machine.example.org': '1.1.1.1', 'second.machine.example.org': '1.1.1.1'})
+
+    def test_failing_machines_are_left_out(self):
+        def hostname(machine):
+            if machine == 'first.machine.example.org':
+                raise RuntimeError('not running')
+            return '2.3.4.5'
+        self.vagrant_instance.hostname.side_effect = hostname
+
+        self.assertDictEqual(
+            vagrant_source.known_hosts(vagrant_root=self.valid_vagrant_root),
+            {'second.machine.example.org': '2.3.4.5'})
+
+    def test_machines_without_hostname_are_left_out(self):
+        self.vagrant_instance.hostname.side_effect = {'second.machine.example.org': '2.3.4.5'}.get
+
+        self.assertDictEqual(
+            vagrant_source.known_hosts(vagrant_root=self.valid_vagrant_root),
+            {'second.machine.example.org': '2.3.4.5'})
+
+    def test_slow_machines_time_out(self):
+        def hostname(machine):
+            if machine == 'first.machine.example.org':
+                self.release.wait(5)
+            return '2.3.4.5'
+        self.vagrant_instance.hostname.side_effect = hostname
+
+        start = time.time()
+        self.assertDictEqual(
+            vagrant_source.known_hosts(vagrant_root=self.valid_vagrant_root, timeout=0.1),
+            {'second.machine.example.org': '2.3.4.5'})
+        self.assertLess(time.time() - start, 1)
+
+    def test_abandoned_calls_do_not_hold_the_process_at_exit(self):
+        def hostname(machine):
+            if machine == 'first.machine.example.org':
+                self.release.wait(5)
+            return '2.3.4.5'
+        self.vagrant_instance.hostname.side_effect = hostname
+
+        vagrant_source.known_hosts(vagrant_root=self.valid_vagrant_root, timeout=0.1)
+
+        stuck = [thread for thread in threading.enumerate() if thread.name == 'hostsresolver-vagrant']
+        self.assertTrue(stuck)
+        self.assertTrue(all(thread.daemon for thread in stuck))
+
+    def test_queued_machines_are_abandoned_when_every_worker_is_stuck(self):
+        def hostname(machine):
+            self.release.wait(5)
+            return '1.1.1.1'
+        self.vagrant_instance.hostname.side_effect = hostname
+
+        start = time.time()
+        self.assertDictEqual(
+            vagrant_source.known_hosts(vagrant_root=self.valid_vagrant_root, workers=1, timeout=0.1),
+            {})
+        self.assertLess(time.time() - start, 1)
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.vagrant_root = os.path.join(directory, 'vagrant_project')
+        shutil.copytree(_resource_path('vagrant_project'), self.vagrant_root)
+
+        self.vagrant_instance = mock.Mock()
+        self.vagrant_instance.ssh_config.return_value = ''
+        patcher = mock.patch('hostsresolver.vagrant_source.Vagrant')
+        patcher.start().return_value = self.vagrant_instance
+        self.addCleanup(patcher.stop)
+        self.known_hosts = {'first.machine.example.org': '1.1.1.1', 'second.machine.example.org': '2.3.4.5'}
+        self.vagrant_instance.hostname.side_effect = self.known_hosts.get
+
+    def test_snapshot_is_reused_while_machines_are_unchanged(self):
+        vagrant_source.known_hosts(self.vagrant_root, snapshot=True)
+        self.vagrant_instance.hostname.reset_mock()
+
+        self.assertDictEqual(vagrant_source.known_hosts(self.vagrant_root, snapshot=True), self.known_hosts)
+        self.assertFalse(self.vagrant_instance.hostname.called)
+        self.assertTrue(os.path.exists(os.path.join(self.vagrant_root, '.vagrant', 'hostsresolver-vagrant.json')))
+
+    def test_snapshot_is_rebuilt_when_a_machine_is_recreated(self):
+        vagrant_source.known_hosts(self.vagrant_root, snapshot=True)
+        self.known_hosts['first.machine.example.org'] = '3.3.3.3'
+        id_path = os.path.join(self.vagrant_root, '.vagrant', 'machines', 'first.machine.example.org', 'openstack', 'id')
+        with open(id_path, 'w') as file:
+            file.write('another-id')
+
+        self.assertEqual(vagrant_source.known_hosts(self.vagrant_root, snapshot=True)['first.machine.example.org'],
+                         '3.3.3.3')
+
+    def test_partial_results_are_not_saved(self):
+        self.vagrant_instance.hostname.side_effect = {'second.machine.example.org': '2.3.4.5'}.get
+        path = os.path.join(self.vagrant_root, 'snapshot.json')
+
+        vagrant_source.known_hosts(self.vagrant_root, snapshot=path)
+
+        self.assertFalse(os.path.exists(path))
+
+
+class TestRefreshingLoader(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.vagrant_root = os.path.join(directory, 'vagrant_project')
+        shutil.copytree(_resource_path('vagrant_project'), self.vagrant_root)
+
+        self.vagrant_instance = mock.Mock()
+        self.vagrant_instance.ssh_config.return_value = ''
+        patcher = mock.patch('hostsresolver.vagrant_source.Vagrant')
+        patcher.start().return_value = self.vagrant_instance
+        self.addCleanup(patcher.stop)
+        self.known_hosts = {'first.machine.example.org': '1.1.1.1', 'second.machine.example.org': '2.3.4.5'}
+        self.vagrant_instance.hostname.side_effect = lambda machine: self.known_hosts[machine]
+
+        self.loader = vagrant_source.RefreshingLoader(self.vagrant_root)
+        self.loader()
+        self.vagrant_instance.hostname.reset_mock()
+
+    def id_path(self, machine):
+        return os.path.join(self.vagrant_root, '.vagrant', 'machines', machine, 'openstack', 'id')
+
+    def recreate(self, machine, address):
+        with open(self.id_path(machine), 'w') as file:
+            file.write('recreated')
+        self.known_hosts[machine] = address
+
+    def test_nothing_is_resolved_when_no_machine_changed(self):
+        self.assertIsNone(self.loader())
+
+        self.assertFalse(self.vagrant_instance.hostname.called)
+
+    def test_only_recreated_machines_are_resolved(self):
+        self.recreate('second.machine.example.org', '5.5.5.5')
+
+        self.assertDictEqual(self.loader(), {'first.machine.example.org': '1.1.1.1',
+                                             'second.machine.example.org': '5.5.5.5'})
+        self.vagrant_instance.hostname.assert_called_once_with('second.machine.example.org')
+
+    def test_destroyed_machines_are_removed(self):
+        os.remove(self.id_path('second.machine.example.org'))
+
+        self.assertDictEqual(self.loader(), {'first.machine.example.org': '1.1.1.1'})
+        self.assertFalse(self.vagrant_instance.hostname.called)
+
+    def test_machines_failing_to_resolve_keep_their_address(self):
+        self.recreate('second.machine.example.org', '5.5.5.5')
+        self.vagrant_instance.hostname.side_effect = subprocess.CalledProcessError(1, 'vagrant ssh-config')
+
+        self.assertIsNone(self.loader())
+
+        self.vagrant_instance.hostname.side_effect = lambda machine: self.known_hosts[machine]
+        self.assertEqual(self.loader()['second.machine.example.org'], '5.5.5.5')
+
+    def test_layer_is_refreshed_in_place(self):
+        cache.register('vagrant-refresh', loader=lambda: {'first.machine.example.org': '1.1.1.1'})
+        self.addCleanup(cache.clear)
+
+        cache.register('vagrant-refresh', loader=lambda: None)
+        cache.refresh('vagrant-refresh')
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+
+
+class TestLazyInstall(unittest.TestCase):
+    def setUp(self):
+        self.valid_vagrant_root = _resource_path('vagrant_project')
+        self.vagrant_instance = mock.Mock()
+        patcher = mock.patch('hostsresolver.vagrant_source.Vagrant')
+        patcher.start().return_value = self.vagrant_instance
+        self.addCleanup(patcher.stop)
+        self.vagrant_instance.hostname.side_effect = {'first.machine.example.org': '1.1.1.1'}.get
+
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(cache.uninstall)
+
+    def test_machines_are_resolved_on_their_first_lookup(self):
+        vagrant_source.install(self.valid_vagrant_root, lazy=True)
+        self.assertFalse(self.vagrant_instance.hostname.called)
+        self.assertFalse(self.vagrant_instance.ssh_config.called)
+
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '1.1.1.1')
+
+        self.vagrant_instance.hostname.assert_called_once_with('first.machine.example.org')
+
+    @mock.patch("hostsresolver.cache._gethostbyname")
+    def test_other_names_never_run_vagrant(self, gethost_mock):
+        gethost_mock.return_value = '3.3.3.3'
+        vagrant_source.install(self.valid_vagrant_root, lazy=True)
+
+        self.assertEqual(cache.gethostbyname('unrelated.example.org'), '3.3.3.3')
+
+        self.assertFalse(self.vagrant_instance.hostname.called)
+
+    def test_cached_lookups_never_run_vagrant(self):
+        vagrant_source.install(self.valid_vagrant_root, lazy=True)
+
+        self.assertIsNone(cache.cached_getaddrinfo('first.machine.example.org', 80))
+        self.assertIsNone(cache.lookup_override('first.machine.example.org', blocking=False))
+        self.assertFalse(self.vagrant_instance.hostname.called)
+
+        self.assertEqual('1.1.1.1', cache.getaddrinfo('first.machine.example.org', 80)[0][4][0])
+        self.assertEqual('1.1.1.1', cache.cached_getaddrinfo('first.machine.example.org', 80)[0][4][0])
+        self.vagrant_instance.hostname.assert_called_once_with('first.machine.example.org')
+
+    def test_failures_are_remembered(self):
+        machines = vagrant_source.LazyMachines(self.valid_vagrant_root)
+
+        self.assertIsNone(machines.get('second.machine.example.org'))
+        self.assertIsNone(machines.get('second.machine.example.org'))
+
+        self.vagrant_instance.hostname.assert_called_once_with('second.machine.example.org')
+        self.assertSetEqual(set(machines), {'first.machine.example.org', 'second.machine.example.org'})
+
+    def test_missing_vagrant_executables_are_misses(self):
+        self.vagrant_instance.hostname.side_effect = RuntimeError('The Vagrant executable cannot be found.')
+        machines = vagrant_source.LazyMachines(self.valid_vagrant_root)
+
+        self.assertRaises(KeyError, machines.__getitem__, 'first.machine.example.org')
+        self.assertIsNone(machines.get('first.machine.example.org'))
+
+        self.vagrant_instance.hostname.assert_called_once_with('first.machine.example.org')
+
+
 class TestInstall(unittest.TestCase):
     def setUp(self):
         self.valid_vagrant_root = _resource_path('vagrant_project')
         self.vagrant_instance = mock.Mock()
+        self.vagrant_instance.ssh_config.return_value = ''
         patcher = mock.patch('hostsresolver.vagrant_source.Vagrant')
         patcher.start().return_value = self.vagrant_instance
         self.addCleanup(patcher.stop)
@@ -123,6 +448,21 @@ class TestInstall(unittest.TestCase):
         self.assertEqual(socket.gethostbyname('first.machine.example.org'), '1.1.1.1')
         self.assertEqual(socket.gethostbyname('second.machine.example.org'), '2.3.4.5')
 
+    def test_install_loads_its_own_layer(self):
+        self.addCleanup(cache.clear)
+        # Not resolved yet, the refresh tries again.
+        self.vagrant_instance.hostname.side_effect = {}.get
+        cache.register('overrides', priority=10)
+        cache.update({'first.machine.example.org': '9.9.9.9'}, layer='overrides')
+
+        vagrant_source.install(vagrant_root=self.valid_vagrant_root)
+        self.vagrant_instance.hostname.side_effect = {'first.machine.example.org': '3.3.3.3'}.get
+        cache.refresh(vagrant_source.layer_name(self.valid_vagrant_root))
+
+        layer, = [layer for layer in cache.layers() if layer.name.startswith('vagrant:')]
+        self.assertDictEqual(layer.hosts, {'first.machine.example.org': '3.3.3.3'})
+        self.assertEqual(cache.gethostbyname('first.machine.example.org'), '9.9.9.9')
+
 
 def _resource_path(path):
     return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
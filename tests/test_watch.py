@@ -0,0 +1,58 @@
+# Copyright 2016 Internap.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributedvagrant_instance under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import unittest
+
+import mock
+
+from hostsresolver.watch import Poller
+
+
+class TestPoller(unittest.TestCase):
+    def test_check_is_called_until_stopped(self):
+        called = threading.Event()
+        poller = Poller(called.set, interval=0.01)
+        self.addCleanup(poller.stop)
+
+        poller.start()
+        self.assertTrue(called.wait(5))
+        self.assertTrue(poller.running)
+
+        poller.stop(5)
+        self.assertFalse(poller.running)
+
+    def test_failing_checks_do_not_stop_the_poller(self):
+        calls = []
+        called_twice = threading.Event()
+
+        def check():
+            calls.append(None)
+            if len(calls) >= 2:
+                called_twice.set()
+            raise RuntimeError('failure')
+
+        poller = Poller(check, interval=0.01)
+        self.addCleanup(poller.stop)
+        with mock.patch('hostsresolver.watch.logger'):
+            poller.start()
+            self.assertTrue(called_twice.wait(5))
+
+    def test_jitter_spreads_the_waits(self):
+        poller = Poller(lambda: None, interval=10, jitter=2)
+
+        waits = [poller._next_wait() for _ in range(100)]
+
+        self.assertTrue(all(8 <= wait <= 12 for wait in waits))
+        self.assertGreater(len(set(waits)), 1)